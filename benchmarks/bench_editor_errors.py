@@ -0,0 +1,76 @@
+"""
+Сравнение поиска авторов по тексту ошибки редактора:
+полный перебор ожидающих файлов против автомата Ахо-Корасик.
+
+Запуск: python benchmarks/bench_editor_errors.py [число файлов]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from script4 import PatternMatcher
+
+ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюяabcdefghijklmnopqrstuvwxyz0123456789"
+
+
+def random_name(rng):
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(12, 40)))
+
+
+def scan(records, text):
+    """Старый способ: проверка каждого имени подстрокой"""
+    return {filename for filename, _ in records if filename in text}
+
+
+def main(pending=10000, messages=200):
+    rng = random.Random(42)
+    records = [(random_name(rng), f"author{i % 50}") for i in range(pending)]
+
+    started = time.perf_counter()
+    matcher = PatternMatcher()
+    matcher.update(filename for filename, _ in records)
+    build = time.perf_counter() - started
+
+    # Поштучное добавление, как при поступлении файлов от авторов
+    extra = [(random_name(rng), "author") for _ in range(pending // 10)]
+    inserts = []
+    for filename, _ in extra:
+        started = time.perf_counter()
+        matcher.add(filename)
+        inserts.append(time.perf_counter() - started)
+    insert_time = sum(inserts) / len(inserts)
+    assert all(matcher.search(filename) >= {filename} for filename, _ in extra[::50])
+    for filename, _ in extra:
+        matcher.remove(filename)
+
+    # Тексты ошибок: несколько упомянутых файлов среди шума
+    texts = []
+    for _ in range(messages):
+        mentioned = [filename for filename, _ in rng.sample(records, 3)]
+        texts.append(random_name(rng).join(mentioned) + "непроверяется" * 20)
+
+    started = time.perf_counter()
+    for text in texts:
+        expected = scan(records, text)
+    scan_time = (time.perf_counter() - started) / messages
+
+    started = time.perf_counter()
+    for text in texts:
+        found = matcher.search(text)
+    matcher_time = (time.perf_counter() - started) / messages
+
+    assert all(scan(records, text) == matcher.search(text) for text in texts[:20])
+
+    print(f"Ожидающих файлов: {pending}, сообщений: {messages}")
+    print(f"Построение автомата: {build * 1000:.1f} мс")
+    print(f"Добавление имени: {insert_time * 1000:.3f} мс в среднем, максимум {max(inserts) * 1000:.3f} мс")
+    print(f"Перебор:  {scan_time * 1000:.3f} мс на сообщение")
+    print(f"Автомат:  {matcher_time * 1000:.3f} мс на сообщение")
+    print(f"Ускорение: x{scan_time / matcher_time:.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,69 @@
+"""
+Нечёткая маршрутизация ответов редактора: время поиска на похожих именах
+(«kursovayarabota1», «kursovayarabota2», ...) и проверка, что соседние файлы не путаются.
+
+Запуск: python benchmarks/bench_fuzzy_routes.py [число файлов]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from script4 import TrigramIndex, normalize_name
+
+# (ожидающий файл, имя от редактора, должен ли найтись)
+CASES = [
+    ("diplomglava1", "diplom_glava2", False),
+    ("otchetpopraktike2", "otchet_po_praktike_3", False),
+    ("referat1", "referat2", False),
+    ("ref1", "ref2", False),
+    ("kursovaya", "kursovaya_испр", True),
+    ("diplomglava1", "diplom_glava1_v2", True),
+    ("otchetpopraktike2", "otchet po praktike 2 (исправлено)", True),
+]
+
+
+def check_cases():
+    failures = 0
+    for pending, returned, expected in CASES:
+        index = TrigramIndex()
+        index.add(pending)
+        found = index.best(normalize_name(returned)) == pending
+        status = "ok" if found == expected else "ОШИБКА"
+        failures += found != expected
+        print(f"{status}: {returned!r} -> {pending!r}: {'найден' if found else 'не найден'}")
+    return failures
+
+
+def timed(index, queries):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        index.best(query)
+        timings.append(time.perf_counter() - started)
+    return sum(timings) / len(timings) * 1000, max(timings) * 1000
+
+
+def main(pending=5000):
+    failures = check_cases()
+
+    index = TrigramIndex()
+    for i in range(pending):
+        index.add(f"kursovayarabota{i}")
+        index.add(f"diplomglava{i}")
+
+    queries = ([f"kursovayarabota{i}ispr" for i in range(0, pending, 50)]
+               + [f"diplomglava{i}v2" for i in range(0, pending, 50)]
+               + [f"kursovayarabota{i}" for i in range(pending, pending + 100)])
+    mean, worst = timed(index, queries)
+    print(f"Ожидающих файлов: {2 * pending}, поиск: в среднем {mean:.3f} мс, максимум {worst:.3f} мс")
+
+    routed = sum(index.best(f"kursovayarabota{i}ispr") == f"kursovayarabota{i}" for i in range(0, pending, 50))
+    print(f"Исправленные файлы нашли своего автора: {routed}/{len(range(0, pending, 50))}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
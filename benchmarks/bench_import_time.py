@@ -0,0 +1,79 @@
+"""
+Проверка, что браузерный стек не грузится при старте script4, и время импорта.
+Завершается с кодом 1, если selenium или webdriver_manager загружены при импорте —
+эта проверка не зависит от шума замеров.
+
+Время: база — импорт всех модулей из импортов верхнего уровня script4 (pyrogram, asyncio и др.).
+Замеры базы и script4 чередуются, собственная часть script4 — медиана разностей пар.
+Бюджет нарушен, только если медиана превышает его больше чем на межквартильный размах
+разностей, то есть выходит за измеренный шум.
+
+Запуск: python benchmarks/bench_import_time.py [бюджет сверх базы, мс] [число пар замеров]
+"""
+import ast
+import os
+import py_compile
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ("selenium", "webdriver_manager")
+
+PROBE = (
+    "import sys, time\n"
+    "started = time.perf_counter()\n"
+    "import {modules}\n"
+    "print((time.perf_counter() - started) * 1000)\n"
+    "print(','.join(sorted({{name.split('.')[0] for name in sys.modules}})))\n"
+)
+
+
+def measure(modules):
+    """Импорт в чистом интерпретаторе: (миллисекунды, загруженные пакеты верхнего уровня)"""
+    output = subprocess.run([sys.executable, "-c", PROBE.format(modules=modules)], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout.splitlines()
+    return float(output[-2]), set(output[-1].split(","))
+
+
+def dependencies():
+    """Модули из импортов верхнего уровня script4: их импорт — нижняя граница времени старта"""
+    with open(os.path.join(ROOT, "script4.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            modules.append(node.module)
+    return ", ".join(dict.fromkeys(modules))
+
+
+def main(budget_ms=50, runs=15):
+    deps = dependencies()
+    # При обычном запуске script4 грузится из кэша байткода, компиляцию не измеряем
+    py_compile.compile(os.path.join(ROOT, "script4.py"))
+    baselines, timings = [], []
+    # Замеры чередуются, чтобы фоновая нагрузка одинаково влияла на оба
+    for _ in range(runs):
+        baselines.append(measure(deps)[0])
+        elapsed, modules = measure("script4")
+        timings.append(elapsed)
+
+    differences = [elapsed - baseline for elapsed, baseline in zip(timings, baselines)]
+    overhead = statistics.median(differences)
+    quartiles = statistics.quantiles(differences, n=4)
+    noise = quartiles[2] - quartiles[0]
+    print(f"Импорт зависимостей: медиана {statistics.median(baselines):.0f} мс")
+    print(f"Импорт script4: медиана {statistics.median(timings):.0f} мс, "
+          f"сверх зависимостей {overhead:.0f} ± {noise:.0f} мс (бюджет {budget_ms} мс)")
+
+    loaded = [name for name in LAZY_MODULES if name in modules]
+    if loaded:
+        print(f"При импорте загружены: {', '.join(loaded)}")
+    if loaded or overhead - noise > budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
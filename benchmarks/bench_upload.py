@@ -0,0 +1,111 @@
+"""
+Пропускная способность загрузки кусками в зависимости от числа соединений
+и докачка после обрыва — против локального имитатора upload-методов MTProto.
+
+Имитатор: у каждого соединения своя полоса и задержка ответа, как у отдельного
+TCP-соединения к медиа-DC; часть запросов случайно падает.
+
+Запуск: python benchmarks/bench_upload.py [размер файла, МБ]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from script4 import ChunkedUploader, UploadIncomplete
+
+
+class FakeEndpoint:
+    """Принимает SaveBigFilePart/SaveFilePart и запоминает полученные куски"""
+
+    def __init__(self, bandwidth=4 * 1024 * 1024, latency=0.03, failure_rate=0.01, die_after=None, seed=1):
+        self.bandwidth = bandwidth  # байт в секунду на соединение
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.die_after = die_after  # после стольких кусков все соединения рвутся
+        self.rng = random.Random(seed)
+        self.received = {}  # file_id -> номера кусков
+        self.requests = 0
+
+    async def open_session(self):
+        return FakeSession(self)
+
+
+class FakeSession:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    async def invoke(self, query):
+        endpoint = self.endpoint
+        endpoint.requests += 1
+        if endpoint.die_after is not None and endpoint.requests > endpoint.die_after:
+            raise ConnectionError("соединение разорвано")
+
+        await asyncio.sleep(endpoint.latency + len(query.bytes) / endpoint.bandwidth)
+        if endpoint.rng.random() < endpoint.failure_rate:
+            raise TimeoutError("таймаут куска")
+        endpoint.received.setdefault(query.file_id, set()).add(query.file_part)
+        return True
+
+    async def stop(self):
+        pass
+
+
+def make_file(directory, size):
+    path = os.path.join(directory, "document.pdf")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path
+
+
+async def throughput(path, size, connections):
+    endpoint = FakeEndpoint()
+    uploader = ChunkedUploader(SimpleNamespace(name="bench"), connections=connections, part_retries=5,
+                               checkpoint_dir=os.path.join(os.path.dirname(path), "uploads"),
+                               open_session=endpoint.open_session)
+    started = time.perf_counter()
+    input_file = await uploader.upload(path)
+    elapsed = time.perf_counter() - started
+    uploader.drop_checkpoint(path)
+    assert len(endpoint.received[input_file.id]) == input_file.parts
+    return size / elapsed / 1024 / 1024
+
+
+async def resume(path, connections=4):
+    """Обрыв на середине: повтор должен отправить только недостающие куски"""
+    checkpoint_dir = os.path.join(os.path.dirname(path), "uploads")
+    total = -(-os.path.getsize(path) // ChunkedUploader.PART_SIZE)
+
+    broken = FakeEndpoint(failure_rate=0, die_after=total // 2)
+    uploader = ChunkedUploader(SimpleNamespace(name="bench"), connections=connections, part_retries=1,
+                               checkpoint_dir=checkpoint_dir, open_session=broken.open_session)
+    try:
+        await uploader.upload(path)
+    except UploadIncomplete as e:
+        print(f"Первая попытка: {e}")
+
+    healthy = FakeEndpoint(failure_rate=0)
+    uploader = ChunkedUploader(SimpleNamespace(name="bench"), connections=connections,
+                               checkpoint_dir=checkpoint_dir, open_session=healthy.open_session)
+    input_file = await uploader.upload(path)
+    uploader.drop_checkpoint(path)
+    print(f"Повтор отправил {healthy.requests} из {input_file.parts} кусков")
+
+
+async def main(size_mb=32):
+    size = size_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_file(directory, size)
+        for connections in (1, 2, 4, 8):
+            speed = await throughput(path, size, connections)
+            print(f"Соединений: {connections}, {speed:.1f} МБ/с")
+        await resume(path)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:2])))
@@ -1,11 +1,21 @@
 import asyncio
+import hashlib
+import json
+import os
+import sys
 import time
 from pyrogram import Client
-from pyrogram.errors import FloodWait, TimeoutError
+from pyrogram.errors import FloodWait
+from pyrogram.types import InputMediaDocument
 
-async def send_file_with_retry(client, chat_id, file_path, max_retries=5, initial_delay=5):
+ALBUM_SIZE = 10  # больше документов в одну медиагруппу Telegram не принимает
+ALBUM_MAX_BYTES = 50 * 1024 * 1024  # объём одной медиагруппы, чтобы запрос не упирался в таймаут
+MANIFEST_NAME = ".sync_manifest.json"  # манифест синхронизации в корне папки
+
+async def send_file_with_retry(client, chat_id, file_path, max_retries=5, initial_delay=5, on_sent=None):
     """
-    Отправка файла с повторными попытками при ошибках таймаута
+    Отправка файла с повторными попытками при ошибках таймаута.
+    После успешной отправки вызывается on_sent(file_path, message)
     """
     delay = initial_delay
     
@@ -20,16 +30,18 @@ async def send_file_with_retry(client, chat_id, file_path, max_retries=5, initia
             print(f"Попытка {attempt + 1} отправки файла: {file_path}")
             
             # Отправка файла с увеличенным таймаутом
-            await client.send_document(
+            message = await client.send_document(
                 chat_id=chat_id,
                 document=file_path,
                 timeout=300  # Увеличенный таймаут 5 минут
             )
             
             print(f"Файл успешно отправлен: {file_path}")
+            if on_sent:
+                on_sent(file_path, message)
             return True
             
-        except TimeoutError as e:
+        except (TimeoutError, asyncio.TimeoutError) as e:
             print(f"Таймаут при отправке файла (попытка {attempt + 1}): {e}")
             
             if attempt < max_retries - 1:
@@ -52,29 +64,95 @@ async def send_file_with_retry(client, chat_id, file_path, max_retries=5, initia
     
     return False
 
-async def send_files_safely(client, chat_id, file_paths, max_concurrent=2):
+def pack_albums(file_paths, max_items=ALBUM_SIZE, max_bytes=ALBUM_MAX_BYTES, sizes=None):
+    """
+    Раскладывает файлы по медиагруппам: не больше max_items документов и max_bytes байт.
+    Пустые, несуществующие и слишком большие файлы идут отдельно.
+    Известные размеры можно передать в sizes, чтобы не обращаться к диску повторно
+    """
+    albums = []
+    current, current_size = [], 0
+    for file_path in file_paths:
+        if sizes and file_path in sizes:
+            size = sizes[file_path]
+        else:
+            size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        if size == 0 or size > max_bytes:
+            albums.append([file_path])
+            continue
+
+        if current and (len(current) == max_items or current_size + size > max_bytes):
+            albums.append(current)
+            current, current_size = [], 0
+        current.append(file_path)
+        current_size += size
+
+    if current:
+        albums.append(current)
+    return albums
+
+async def send_album_with_retry(client, chat_id, file_paths, max_retries=5, on_sent=None):
     """
-    Безопасная отправка нескольких файлов с ограничением одновременных запросов
+    Отправка документов одной медиагруппой.
+    Возвращает результат по каждому файлу; если группа не ушла, файлы отправляются по одному
+    """
+    if len(file_paths) == 1:
+        return [await send_file_with_retry(client, chat_id, file_paths[0], on_sent=on_sent)]
+
+    for attempt in range(max_retries):
+        try:
+            print(f"Попытка {attempt + 1} отправки медиагруппы из {len(file_paths)} файлов")
+            messages = await client.send_media_group(
+                chat_id=chat_id,
+                media=[InputMediaDocument(file_path) for file_path in file_paths]
+            )
+            print(f"Медиагруппа успешно отправлена: {', '.join(file_paths)}")
+            if on_sent:
+                for file_path, message in zip(file_paths, messages):
+                    on_sent(file_path, message)
+            return [True] * len(file_paths)
+
+        except FloodWait as e:
+            wait_time = e.value
+            print(f"FloodWait: необходимо подождать {wait_time} секунд")
+            await asyncio.sleep(wait_time)
+            continue
+
+        except Exception as e:
+            print(f"Ошибка отправки медиагруппы ({e}), отправляем файлы по одному")
+            break
+
+    return [await send_file_with_retry(client, chat_id, file_path, on_sent=on_sent) for file_path in file_paths]
+
+async def send_files_safely(client, chat_id, file_paths, max_concurrent=2, pack=True, on_sent=None, sizes=None):
+    """
+    Безопасная отправка нескольких файлов с ограничением одновременных запросов.
+    При pack=True документы упаковываются в медиагруппы до 10 штук — один запрос вместо десяти.
+    on_sent(file_path, message) вызывается для каждого отправленного файла
     """
     semaphore = asyncio.Semaphore(max_concurrent)
+    batches = pack_albums(file_paths, sizes=sizes) if pack else [[file_path] for file_path in file_paths]
     
-    async def send_with_semaphore(file_path):
+    async def send_with_semaphore(batch):
         async with semaphore:
-            return await send_file_with_retry(client, chat_id, file_path)
+            return await send_album_with_retry(client, chat_id, batch, on_sent=on_sent)
     
     # Создаем задачи для отправки файлов
-    tasks = [send_with_semaphore(file_path) for file_path in file_paths]
+    tasks = [send_with_semaphore(batch) for batch in batches]
     
     # Выполняем с ограничением одновременных запросов
     results = await asyncio.gather(*tasks, return_exceptions=True)
     
-    # Анализируем результаты
+    # Анализируем результаты по каждому файлу
     successful = 0
-    for file_path, result in zip(file_paths, results):
-        if result is True:
-            successful += 1
-        else:
-            print(f"Не удалось отправить файл: {file_path}")
+    for batch, result in zip(batches, results):
+        if isinstance(result, BaseException):
+            result = [result] * len(batch)
+        for file_path, sent in zip(batch, result):
+            if sent is True:
+                successful += 1
+            else:
+                print(f"Не удалось отправить файл: {file_path}")
     
     print(f"Успешно отправлено: {successful}/{len(file_paths)} файлов")
     return successful
@@ -108,6 +186,124 @@ async def main():
         else:
             print("Нет валидных файлов для отправки")
 
+def scan_tree(root, skip=()):
+    """Все файлы в папке root и её подпапках: пары (путь, stat) без лишних обращений к диску"""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_tree(entry.path, skip)
+            elif entry.is_file() and entry.name not in skip:
+                yield entry.path, entry.stat()
+
+def file_hash(file_path):
+    """SHA-256 содержимого файла, читается кусками по 1 МБ"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(manifest_path):
+    """
+    Манифест синхронизации: относительный путь -> size, mtime, hash, message_id.
+    Поверх снимка применяется журнал записей, сделанных после него
+    """
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    if os.path.exists(manifest_path + ".log"):
+        with open(manifest_path + ".log", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # недописанная последняя строка после сбоя
+                manifest[record.pop("path")] = record
+    return manifest
+
+def save_manifest(manifest_path, manifest):
+    """Атомарно записывает снимок манифеста и очищает журнал"""
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest_path + ".tmp", manifest_path)
+    if os.path.exists(manifest_path + ".log"):
+        os.remove(manifest_path + ".log")
+
+def journal_manifest(manifest_path, path, entry):
+    """
+    Дописывает одну запись в журнал манифеста и сбрасывает её на диск.
+    Стоимость записи не зависит от размера дерева
+    """
+    with open(manifest_path + ".log", "a", encoding="utf-8") as f:
+        f.write(json.dumps({"path": path, **entry}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+async def sync_directory(client, chat_id, root, manifest_path=None):
+    """
+    Отправляет только новые и изменённые файлы из папки root.
+    Хэш считается, лишь когда у файла изменились размер или время изменения.
+    Каждая отправка сразу записывается в манифест, поэтому прерванный запуск
+    можно повторить — уже отправленные файлы второй раз не уйдут
+    """
+    manifest_path = manifest_path or os.path.join(root, MANIFEST_NAME)
+    skip = {os.path.basename(manifest_path) + suffix for suffix in ("", ".log", ".tmp")}
+    manifest = load_manifest(manifest_path)
+
+    changed, sizes, seen = [], {}, set()
+    for file_path, stat in scan_tree(root, skip):
+        path = os.path.relpath(file_path, root)
+        seen.add(path)
+        if stat.st_size == 0:
+            print(f"Пропускаем файл с нулевым размером: {file_path}")
+            continue
+
+        entry = manifest.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            digest = file_hash(file_path)
+            if entry is None or entry["hash"] != digest:
+                entry = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": digest, "message_id": None}
+            else:
+                # Содержимое то же, изменилось только время — отправлять не нужно
+                entry = {**entry, "size": stat.st_size, "mtime": stat.st_mtime}
+            manifest[path] = entry
+            journal_manifest(manifest_path, path, entry)
+
+        if entry["message_id"] is None:
+            changed.append(file_path)
+            sizes[file_path] = stat.st_size
+
+    # Удалённые файлы больше не отслеживаем
+    for path in set(manifest) - seen:
+        del manifest[path]
+
+    print(f"Новых и изменённых файлов: {len(changed)} из {len(seen)}")
+
+    def on_sent(file_path, message):
+        path = os.path.relpath(file_path, root)
+        manifest[path] = {**manifest[path], "message_id": message.id}
+        journal_manifest(manifest_path, path, manifest[path])
+
+    try:
+        if changed:
+            await send_files_safely(client, chat_id, changed, on_sent=on_sent, sizes=sizes)
+    finally:
+        save_manifest(manifest_path, manifest)
+
+async def sync_main(root):
+    """Синхронизация папки с чатом: python script.py <папка>"""
+    # Ваши данные API
+    api_id = 'your_api_id'
+    api_hash = 'your_api_hash'
+
+    async with Client("my_account", api_id, api_hash) as client:
+        chat_id = "your_chat_id"  # ID чата или канала
+        await sync_directory(client, chat_id, root)
+
 # Дополнительная функция для проверки файла перед отправкой
 def validate_file(file_path):
     """
@@ -140,10 +336,11 @@ async def send_single_file_safely(client, chat_id, file_path):
 
 # Запуск
 if __name__ == "__main__":
-    import os
-    
     # Для Windows и macOS
     if os.name == 'nt':  # Windows
         asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
     
-    asyncio.run(main())
\ No newline at end of file
+    if len(sys.argv) > 1:
+        asyncio.run(sync_main(sys.argv[1]))
+    else:
+        asyncio.run(main())
\ No newline at end of file
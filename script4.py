@@ -1,33 +1,680 @@
 import shutil
 
-from pyrogram import Client, filters
+from pyrogram import Client, filters, raw
+from pyrogram.errors import FloodWait
+from pyrogram.handlers import MessageHandler
+from pyrogram.session import Session
 from pyrogram.types import InputMediaDocument
 from decouple import config
 import asyncio
 import os
 import re
-from io import BytesIO
+import io
 import glob
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 import time
 from colorama import Fore, Style
 import platform
-from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver import ActionChains
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.remote.webdriver import WebDriver
-from selenium.webdriver.chrome.options import Options
 import sqlite3
+import json
+import hashlib
+import mimetypes
+import heapq
+import math
+import itertools
+import tempfile
+import threading
+import queue
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+import contextvars
+from types import SimpleNamespace
 
 stop_event = asyncio.Event()
 bot_name = "Antiplagiat_Check_AI_bot"
 
+# Всё, кроме букв и цифр, из имён файлов убирается
+FILENAME_JUNK_RE = re.compile(r'[^a-zA-Zа-яА-ЯёЁ0-9]', flags=re.IGNORECASE)
+
+
+def normalize_name(text):
+    """Нормализованное имя файла: только буквы и цифры в нижнем регистре"""
+    return FILENAME_JUNK_RE.sub('', text).lower()
+
+
+class AccountGate:
+    """Пауза всех отправок аккаунта на время FloodWait"""
+
+    def __init__(self):
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def wait(self):
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+
+class AdaptiveLimiter:
+    """
+    Ограничитель одновременных отправок в чат по схеме AIMD:
+    лимит растёт на единицу за «окно» успешных отправок и делится пополам при FloodWait.
+    """
+
+    def __init__(self, gate, initial=2, minimum=1, maximum=16):
+        self.gate = gate
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.active = 0
+        self.condition = None
+
+    async def __aenter__(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+        await self.gate.wait()
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        before = int(self.limit)
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        # Будим ожидающих, только когда лимит действительно вырос
+        if int(self.limit) > before and self.condition is not None:
+            asyncio.create_task(self._wake())
+
+    def on_flood(self, seconds):
+        self.limit = max(self.minimum, self.limit / 2)
+        self.gate.pause(seconds)
+
+    async def _wake(self):
+        async with self.condition:
+            self.condition.notify_all()
+
+
+class FloodController:
+    """Общие на процесс ограничители отправок по аккаунтам и чатам"""
+
+    def __init__(self):
+        self.gates = {}  # client -> AccountGate
+        self.limiters = {}  # (client, chat_id) -> AdaptiveLimiter
+
+    def gate(self, client):
+        if client not in self.gates:
+            self.gates[client] = AccountGate()
+        return self.gates[client]
+
+    def limiter(self, client, chat_id, initial=2):
+        key = (client, chat_id)
+        if key not in self.limiters:
+            self.limiters[key] = AdaptiveLimiter(self.gate(client), initial=initial)
+        return self.limiters[key]
+
+
+flood_control = FloodController()
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst про запас"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд будет доступен токен"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def available(self, now):
+        """Сколько токенов есть прямо сейчас (может быть меньше нуля после FloodWait)"""
+        self._refill(now)
+        return self.tokens
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Опустошает корзину на seconds секунд (после FloodWait)"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+def rate_config(name, default):
+    """Пара «скорость,запас» из .env, например RATE_SEND=5,10"""
+    rate, burst = config(name, default=default).split(",")
+    return float(rate), float(burst)
+
+
+class RateScheduler:
+    """
+    Центральный планировщик вызовов Telegram.
+    Каждый вызов client.invoke проходит через корзины токенов аккаунта,
+    класса метода и чата. Ожидающие обслуживаются по полосам приоритета.
+    """
+
+    LANES = {"delivery": 0, "default": 1, "polling": 2, "bulk": 3}
+    METHOD_CLASSES = {
+        "SendMedia": "send", "SendMultiMedia": "send", "SendMessage": "send",
+        "ForwardMessages": "send", "EditMessage": "send",
+        "GetHistory": "read", "GetMessages": "read", "Search": "read",
+    }
+
+    def __init__(self):
+        self.lane_var = contextvars.ContextVar("telegram_lane", default="default")
+        self.account_rate = rate_config("RATE_ACCOUNT", "20,30")
+        self.class_rates = {
+            "send": rate_config("RATE_SEND", "5,10"),
+            "read": rate_config("RATE_READ", "2,5"),
+            "other": rate_config("RATE_OTHER", "10,20"),
+        }
+        self.peer_rate = rate_config("RATE_PEER", "1,3")
+        self.accounts = {}
+        self.counter = itertools.count()
+        self.waited = defaultdict(float)  # полоса -> суммарное ожидание
+        self.waited_max = defaultdict(float)
+        self.granted = defaultdict(int)
+
+    def _account(self, name):
+        if name not in self.accounts:
+            self.accounts[name] = {
+                "bucket": TokenBucket(*self.account_rate),
+                "classes": {klass: TokenBucket(*rate) for klass, rate in self.class_rates.items()},
+                "peers": {},
+                "waiting": [],  # отсортированы по (полоса, номер)
+                "timer": None,
+            }
+        return self.accounts[name]
+
+    def attach(self, client, name):
+        """Пропускает все вызовы клиента через планировщик"""
+        invoke = client.invoke
+
+        async def scheduled_invoke(query, *args, **kwargs):
+            klass = self.METHOD_CLASSES.get(type(query).__name__, "other")
+            peer = self.peer_key(query)
+            await self.acquire(name, klass, peer)
+            try:
+                return await invoke(query, *args, **kwargs)
+            except FloodWait as e:
+                # Telegram сам сказал, сколько ждать, — не тратим токены впустую
+                self.on_flood(name, klass, peer, e.value)
+                raise
+
+        client.invoke = scheduled_invoke
+
+    @staticmethod
+    def peer_key(query):
+        peer = getattr(query, "peer", None) or getattr(query, "to_peer", None)
+        if peer is None:
+            return None
+        for attr in ("user_id", "chat_id", "channel_id"):
+            if getattr(peer, attr, None) is not None:
+                return attr, getattr(peer, attr)
+        return type(peer).__name__
+
+    @contextmanager
+    def lane(self, lane):
+        """Полоса приоритета для вызовов внутри блока with"""
+        token = self.lane_var.set(lane)
+        try:
+            yield
+        finally:
+            self.lane_var.reset(token)
+
+    def _buckets(self, account, klass, peer):
+        buckets = [account["bucket"], account["classes"][klass]]
+        if peer is not None and klass == "send":
+            if peer not in account["peers"]:
+                account["peers"][peer] = TokenBucket(*self.peer_rate)
+            buckets.append(account["peers"][peer])
+        return buckets
+
+    async def acquire(self, name, klass, peer):
+        account = self._account(name)
+        lane = self.lane_var.get()
+        future = asyncio.get_running_loop().create_future()
+        entry = (self.LANES.get(lane, 1), next(self.counter), klass, peer, future)
+        # Номера уникальны, поэтому кортежи сравниваются только по (полоса, номер)
+        bisect.insort(account["waiting"], entry)
+        started = time.monotonic()
+
+        self._dispatch(account)
+        try:
+            await future
+        finally:
+            if future.cancelled() and entry in account["waiting"]:
+                account["waiting"].remove(entry)
+                self._dispatch(account)
+
+        waited = time.monotonic() - started
+        self.waited[lane] += waited
+        self.waited_max[lane] = max(self.waited_max[lane], waited)
+        self.granted[lane] += 1
+
+    def _dispatch(self, account):
+        """Выдаёт токены ожидающим по приоритету и заводит таймер до следующей выдачи"""
+        if account["timer"] is not None:
+            account["timer"].cancel()
+            account["timer"] = None
+
+        now = time.monotonic()
+        claimed = set()  # корзины, которых ждёт более приоритетный вызов
+        next_delay = None
+        remaining = []
+        for entry in account["waiting"]:
+            _, _, klass, peer, future = entry
+            if future.done():
+                continue
+
+            buckets = self._buckets(account, klass, peer)
+            not_ready = [b for b in buckets if b.delay(now) > 0]
+            if not not_ready and not any(id(b) in claimed for b in buckets):
+                for bucket in buckets:
+                    bucket.take()
+                future.set_result(None)
+                continue
+
+            remaining.append(entry)
+            for bucket in not_ready:
+                claimed.add(id(bucket))
+                delay = bucket.delay(now)
+                next_delay = delay if next_delay is None else min(next_delay, delay)
+
+        account["waiting"] = remaining
+        if remaining and next_delay is not None:
+            account["timer"] = asyncio.get_running_loop().call_later(next_delay, self._dispatch, account)
+
+    def headroom(self, name, klass="send"):
+        """Запас вызовов класса klass, доступных аккаунту без ожидания"""
+        account = self._account(name)
+        now = time.monotonic()
+        tokens = min(account["bucket"].available(now), account["classes"][klass].available(now))
+        return tokens - len(account["waiting"])
+
+    def on_flood(self, name, klass, peer, seconds):
+        account = self._account(name)
+        for bucket in self._buckets(account, klass, peer)[1:]:
+            bucket.block(seconds)
+
+    def stats(self):
+        """Глубина очередей по аккаунтам и время ожидания по полосам"""
+        depth = {name: len(account["waiting"]) for name, account in self.accounts.items()}
+        waits = {lane: {"calls": self.granted[lane],
+                        "avg": self.waited[lane] / self.granted[lane],
+                        "max": self.waited_max[lane]}
+                 for lane in self.granted}
+        return {"depth": depth, "wait": waits}
+
+    def report(self):
+        stats = self.stats()
+        lines = [f"Очередь {name}: {depth}" for name, depth in stats["depth"].items()]
+        for lane, wait in stats["wait"].items():
+            lines.append(f"Полоса {lane}: {wait['calls']} вызовов, ожидание "
+                         f"в среднем {wait['avg'] * 1000:.0f} мс, максимум {wait['max'] * 1000:.0f} мс")
+        return "\n".join(lines)
+
+
+telegram_scheduler = RateScheduler()
+
+
+class AccountUnavailable(Exception):
+    """Аккаунт задачи не запущен; задача ждёт его, а не тратит попытки"""
+
+
+class ClientPool:
+    """
+    Аккаунты Telegram с ролями. Исходящие отправки роли распределяются
+    между её аккаунтами по запасу токенов планировщика и байтам в полёте.
+    """
+
+    ROLES = ("intake", "bot", "editor", "delivery")
+    BYTES_PER_TOKEN = 16 * 1024 * 1024  # столько байт в полёте считаются за один вызов
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.clients = {}
+        self.roles = defaultdict(list)  # роль -> имена аккаунтов
+        self.pending = defaultdict(int)  # отправки, выбранные, но ещё не завершённые
+        self.in_flight = defaultdict(int)  # байты этих отправок
+        self.contacts = defaultdict(set)  # автор -> аккаунты, которым он писал
+
+    @staticmethod
+    def default_roles(index):
+        """
+        Первый аккаунт принимает файлы, работает с ботом и отвечает авторам, остальные — с редактором.
+        Авторам по умолчанию пишет только аккаунт, которому они сами прислали файлы.
+        """
+        if index == 1:
+            return "intake,bot,delivery"
+        return "editor"
+
+    def add(self, name, client, roles):
+        self.clients[name] = client
+        for role in roles:
+            if role not in self.ROLES:
+                print(Fore.RED + f"Неизвестная роль {role} у {name}" + Style.RESET_ALL)
+                continue
+            self.roles[role].append(name)
+
+    def with_role(self, role):
+        return [self.clients[name] for name in self.roles[role]]
+
+    def get(self, name):
+        """Запущенный аккаунт по имени, иначе AccountUnavailable"""
+        client = self.clients.get(name)
+        if client is None:
+            raise AccountUnavailable(f"Аккаунт {name} не запущен")
+        return client
+
+    def name_of(self, client):
+        for name, candidate in self.clients.items():
+            if candidate is client:
+                return name
+        raise KeyError("Клиент не входит в пул")
+
+    def first(self, role):
+        """Основной аккаунт роли — для диалогов, где важен один и тот же отправитель"""
+        if not self.roles[role]:
+            raise KeyError(f"Нет аккаунта с ролью {role}")
+        return self.clients[self.roles[role][0]]
+
+    def talked(self, name, author):
+        """Запоминает, что автор author писал аккаунту name"""
+        if author:
+            self.contacts[author.lower()].add(name)
+
+    def score(self, name):
+        return (self.scheduler.headroom(name, "send") - self.pending[name]
+                - self.in_flight[name] / self.BYTES_PER_TOKEN)
+
+    def pick(self, role, author=None):
+        """
+        Аккаунт роли с наибольшим запасом. Автору пишут только аккаунты, которым он писал сам:
+        сообщения от незнакомых аккаунтов путают автора и ведут к PEER_FLOOD.
+        """
+        known = self.contacts.get(author.lower(), ()) if author else ()
+        if known:
+            names = [name for name in known if name in self.clients]
+            if not names:
+                raise AccountUnavailable(f"Не запущен ни один аккаунт, которому писал {author}")
+            return max(names, key=self.score)
+        if not self.roles[role]:
+            raise KeyError(f"Нет аккаунта с ролью {role}")
+        return max(self.roles[role], key=self.score)
+
+    @contextmanager
+    def sender(self, role, size=0, author=None):
+        """Выбирает аккаунт для отправки и учитывает её до выхода из блока with"""
+        name = self.pick(role, author)
+        self.pending[name] += 1
+        self.in_flight[name] += size
+        try:
+            yield self.clients[name]
+        finally:
+            self.pending[name] -= 1
+            self.in_flight[name] -= size
+
+
+class UploadIncomplete(Exception):
+    """Часть кусков не загрузилась; прогресс сохранён, повтор догрузит недостающие"""
+
+
+class ChunkedUploader:
+    """
+    Загрузка больших документов кусками по нескольким соединениям.
+    Каждый кусок повторяется отдельно, а номера загруженных кусков сохраняются
+    в контрольную точку, поэтому повторная попытка отправляет только недостающие.
+    open_session можно подменить: это фабрика объектов с методами invoke и stop.
+    """
+
+    PART_SIZE = 512 * 1024  # максимальный размер куска в Telegram
+    BIG_FILE = 10 * 1024 * 1024  # больше этого — SaveBigFilePart и InputFileBig
+
+    def __init__(self, client, connections=4, part_retries=5, checkpoint_dir="uploads",
+                 resume_ttl=6 * 3600, open_session=None):
+        self.client = client
+        self.connections = connections
+        self.part_retries = part_retries
+        self.checkpoint_dir = checkpoint_dir
+        self.resume_ttl = resume_ttl  # сколько Telegram гарантированно хранит загруженные куски
+        self.open_session = open_session or self._open_session
+        self.saved = 0
+
+    async def _open_session(self):
+        storage = self.client.storage
+        session = Session(self.client, await storage.dc_id(), await storage.auth_key(),
+                          await storage.test_mode(), is_media=True)
+        await session.start()
+        return session
+
+    @staticmethod
+    def _random_id():
+        return int.from_bytes(os.urandom(8), "big", signed=True)
+
+    def _checkpoint_path(self, file_path):
+        key = hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest()
+        return os.path.join(self.checkpoint_dir, f"{key}.json")
+
+    def _load_checkpoint(self, file_path, total):
+        """Контрольная точка, если она от того же файла и аккаунта и ещё не устарела"""
+        stat = os.stat(file_path)
+        fresh = {"account": self.client.name, "size": stat.st_size, "mtime": stat.st_mtime,
+                 "parts": total, "file_id": self._random_id(), "created": time.time(), "done": []}
+        try:
+            with open(self._checkpoint_path(file_path)) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return fresh
+
+        same = all(checkpoint.get(key) == fresh[key] for key in ("account", "size", "mtime", "parts"))
+        if not same or time.time() - checkpoint["created"] > self.resume_ttl:
+            return fresh
+        return checkpoint
+
+    def _save_checkpoint(self, file_path, checkpoint, done):
+        checkpoint["done"] = sorted(done)
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self._checkpoint_path(file_path)
+        with open(path + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(path + ".tmp", path)
+        self.saved = time.monotonic()
+
+    def drop_checkpoint(self, file_path):
+        try:
+            os.remove(self._checkpoint_path(file_path))
+        except FileNotFoundError:
+            pass
+
+    async def upload(self, file_path):
+        """Загружает недостающие куски и возвращает InputFile для отправки"""
+        size = os.path.getsize(file_path)
+        total = max(1, -(-size // self.PART_SIZE))
+        big = size > self.BIG_FILE
+        checkpoint = self._load_checkpoint(file_path, total)
+        done = set(checkpoint["done"])
+        missing = deque(part for part in range(total) if part not in done)
+
+        if missing:
+            if done:
+                print(f"Продолжаем загрузку {file_path}: осталось {len(missing)} из {total} кусков")
+            sessions = await asyncio.gather(
+                *(self.open_session() for _ in range(min(self.connections, len(missing)))))
+            try:
+                await asyncio.gather(*(self._send_parts(session, file_path, checkpoint, big, missing, done)
+                                       for session in sessions))
+            finally:
+                for session in sessions:
+                    await session.stop()
+                self._save_checkpoint(file_path, checkpoint, done)
+
+        if len(done) < total:
+            raise UploadIncomplete(f"загружено {len(done)} из {total} кусков")
+
+        name = os.path.basename(file_path)
+        if big:
+            return raw.types.InputFileBig(id=checkpoint["file_id"], parts=total, name=name)
+        return raw.types.InputFile(id=checkpoint["file_id"], parts=total, name=name, md5_checksum="")
+
+    async def _send_parts(self, session, file_path, checkpoint, big, missing, done):
+        """Одно соединение забирает куски из общей очереди, пока они не кончатся"""
+        with open(file_path, "rb") as f:
+            while missing:
+                part = missing.popleft()
+                f.seek(part * self.PART_SIZE)
+                data = f.read(self.PART_SIZE)
+                if big:
+                    query = raw.functions.upload.SaveBigFilePart(
+                        file_id=checkpoint["file_id"], file_part=part,
+                        file_total_parts=checkpoint["parts"], bytes=data)
+                else:
+                    query = raw.functions.upload.SaveFilePart(
+                        file_id=checkpoint["file_id"], file_part=part, bytes=data)
+
+                if not await self._send_part(session, query):
+                    # Соединение сдалось: остальные куски догрузят другие или следующая попытка
+                    missing.appendleft(part)
+                    return
+
+                done.add(part)
+                if time.monotonic() - self.saved > 1:
+                    self._save_checkpoint(file_path, checkpoint, done)
+
+    async def _send_part(self, session, query):
+        delay = 1
+        for attempt in range(self.part_retries):
+            try:
+                if await session.invoke(query):
+                    return True
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+                continue
+            except Exception as e:
+                print(f"Ошибка загрузки куска {query.file_part} (попытка {attempt + 1}): {e}")
+
+            await asyncio.sleep(delay)
+            delay *= 2
+        return False
+
+    async def send_document(self, chat_id, file_path, caption=""):
+        """Загрузка кусками и отправка документа; контрольная точка удаляется после отправки"""
+        input_file = await self.upload(file_path)
+        media = raw.types.InputMediaUploadedDocument(
+            mime_type=mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+            file=input_file,
+            attributes=[raw.types.DocumentAttributeFilename(file_name=os.path.basename(file_path))])
+        await self.client.invoke(raw.functions.messages.SendMedia(
+            peer=await self.client.resolve_peer(chat_id), media=media,
+            message=caption, random_id=self._random_id()))
+        self.drop_checkpoint(file_path)
+
+
+# Файлы больше порога отправляются кусками по нескольким соединениям
+chunked_upload_threshold = config('CHUNKED_UPLOAD_THRESHOLD', default=20 * 1024 * 1024, cast=int)
+upload_connections = config('UPLOAD_CONNECTIONS', default=4, cast=int)
+# Сколько байт документов собирается в одну медиагруппу при массовой отправке
+album_byte_limit = config('ALBUM_BYTE_LIMIT', default=50 * 1024 * 1024, cast=int)
+
+
+class RangedDownloader:
+    """
+    Скачивание документа параллельными диапазонами прямо в заранее выделенный файл.
+    Файл делится на connections сплошных диапазонов, по одному потоку stream_media на каждый:
+    каждый вызов stream_media открывает новую медиа-сессию (для чужого DC — с авторизацией),
+    поэтому их число не растёт с размером файла. При обрыве поток продолжается
+    с первого недополученного куска своего диапазона.
+    """
+
+    CHUNK = 1024 * 1024  # stream_media отдаёт куски по 1 МиБ, offset и limit считаются в кусках
+
+    def __init__(self, client, connections=4, retries=5):
+        self.client = client
+        self.connections = connections
+        self.retries = retries
+        self.received = 0
+
+    async def download(self, media, file_size, path, progress=None, progress_args=()):
+        """Скачивает media размером file_size в path; при ошибке недокачанный файл удаляется"""
+        total = -(-file_size // self.CHUNK)
+        per_range = -(-total // max(1, self.connections))
+        ranges = [(start, min(per_range, total - start)) for start in range(0, total, per_range)]
+        self.received = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.truncate(file_size)
+
+        workers = [asyncio.create_task(self._worker(media, path, start, count, file_size, progress, progress_args))
+                   for start, count in ranges]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            raise
+        return os.path.abspath(path)
+
+    async def _worker(self, media, path, start, count, file_size, progress, progress_args):
+        # У каждого воркера свой дескриптор, запись идёт по смещению своего диапазона
+        with open(path, "r+b") as f:
+            await self._fetch_range(media, f, start, count, file_size, progress, progress_args)
+
+    async def _fetch_range(self, media, f, start, count, file_size, progress, progress_args):
+        written = 0
+        attempt = 0
+        delay = 1
+        while True:
+            try:
+                async for chunk in self.client.stream_media(media, offset=start + written, limit=count - written):
+                    f.seek((start + written) * self.CHUNK)
+                    f.write(chunk)
+                    written += 1
+                    self.received += len(chunk)
+                    if progress:
+                        progress(self.received, file_size, *progress_args)
+                if written >= count:
+                    return
+                raise ConnectionError(f"поток оборвался на куске {start + written}")
+
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.retries:
+                    raise
+                print(Fore.YELLOW + f"Повтор диапазона с куска {start + written}: {e}" + Style.RESET_ALL)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+
+# Параллельные диапазоны при скачивании; столько же одновременных передач разрешается клиенту
+download_connections = config('DOWNLOAD_CONNECTIONS', default=4, cast=int)
+
 
 class FileSender:
     """Класс для безопасной отправки файлов с обработкой ошибок"""
@@ -35,9 +682,11 @@ class FileSender:
     @staticmethod
     async def send_file_with_retry(client, chat_id, file_path, max_retries=5, initial_delay=5):
         """
-        Отправка файла с повторными попытками при ошибках таймаута
+        Отправка файла с повторными попытками при ошибках таймаута.
+        FloodWait приостанавливает все отправки аккаунта, а не только эту.
         """
         delay = initial_delay
+        limiter = flood_control.limiter(client, chat_id)
         
         for attempt in range(max_retries):
             try:
@@ -46,20 +695,27 @@ class FileSender:
                 if file_size == 0:
                     print(f"Ошибка: Файл {file_path} имеет нулевой размер")
                     return False
-                    
+
+                # Ждём, если аккаунт поставлен на паузу из-за FloodWait
+                await limiter.gate.wait()
                 print(f"Попытка {attempt + 1} отправки файла: {file_path}")
                 
-                # Отправка файла с увеличенным таймаутом
-                await client.send_document(
-                    chat_id=chat_id,
-                    document=file_path,
-                    timeout=300  # Увеличенный таймаут 5 минут
-                )
+                if file_size > chunked_upload_threshold:
+                    # Большой файл: куски параллельно, повтор догружает только недостающие
+                    await ChunkedUploader(client, connections=upload_connections).send_document(chat_id, file_path)
+                else:
+                    # Отправка файла с увеличенным таймаутом
+                    await client.send_document(
+                        chat_id=chat_id,
+                        document=file_path,
+                        timeout=300  # Увеличенный таймаут 5 минут
+                    )
                 
+                limiter.on_success()
                 print(f"Файл успешно отправлен: {file_path}")
                 return True
                 
-            except TimeoutError as e:
+            except (TimeoutError, UploadIncomplete) as e:
                 print(f"Таймаут при отправке файла (попытка {attempt + 1}): {e}")
                 
                 if attempt < max_retries - 1:
@@ -73,7 +729,8 @@ class FileSender:
             except FloodWait as e:
                 wait_time = e.value
                 print(f"FloodWait: необходимо подождать {wait_time} секунд")
-                await asyncio.sleep(wait_time)
+                # Снижаем параллельность и ставим на паузу весь аккаунт
+                limiter.on_flood(wait_time)
                 continue
                 
             except Exception as e:
@@ -83,29 +740,94 @@ class FileSender:
         return False
 
     @staticmethod
-    async def send_files_safely(client, chat_id, file_paths, max_concurrent=2):
+    def pack_albums(file_paths, max_items=10, max_bytes=album_byte_limit):
+        """
+        Раскладывает файлы по медиагруппам: не больше max_items документов и max_bytes байт.
+        Пустые, несуществующие и большие файлы идут отдельно — их проверит и отправит send_file_with_retry.
+        """
+        albums = []
+        current, current_size = [], 0
+        for file_path in file_paths:
+            size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+            if size == 0 or size > min(max_bytes, chunked_upload_threshold):
+                albums.append([file_path])
+                continue
+
+            if current and (len(current) == max_items or current_size + size > max_bytes):
+                albums.append(current)
+                current, current_size = [], 0
+            current.append(file_path)
+            current_size += size
+
+        if current:
+            albums.append(current)
+        return albums
+
+    @staticmethod
+    async def send_album_with_retry(client, chat_id, file_paths, max_retries=5):
+        """
+        Отправка документов одной медиагруппой.
+        Возвращает результат по каждому файлу; если группа не ушла, файлы отправляются по одному.
+        """
+        if len(file_paths) == 1:
+            return [await FileSender.send_file_with_retry(client, chat_id, file_paths[0])]
+
+        limiter = flood_control.limiter(client, chat_id)
+        for attempt in range(max_retries):
+            try:
+                await limiter.gate.wait()
+                print(f"Попытка {attempt + 1} отправки медиагруппы из {len(file_paths)} файлов")
+                await client.send_media_group(
+                    chat_id=chat_id,
+                    media=[InputMediaDocument(file_path) for file_path in file_paths]
+                )
+                limiter.on_success()
+                print(f"Медиагруппа успешно отправлена: {', '.join(file_paths)}")
+                return [True] * len(file_paths)
+
+            except FloodWait as e:
+                print(f"FloodWait: необходимо подождать {e.value} секунд")
+                limiter.on_flood(e.value)
+                continue
+
+            except Exception as e:
+                print(f"Ошибка отправки медиагруппы ({e}), отправляем файлы по одному")
+                break
+
+        return [await FileSender.send_file_with_retry(client, chat_id, file_path) for file_path in file_paths]
+
+    @staticmethod
+    async def send_files_safely(client, chat_id, file_paths, max_concurrent=2, pack=True):
         """
-        Безопасная отправка нескольких файлов с ограничением одновременных запросов
+        Безопасная отправка нескольких файлов.
+        При pack=True документы упаковываются в медиагруппы до 10 штук — один запрос вместо десяти.
+        Число одновременных отправок подстраивается под FloodWait, начиная с max_concurrent.
         """
-        semaphore = asyncio.Semaphore(max_concurrent)
+        limiter = flood_control.limiter(client, chat_id, initial=max_concurrent)
+        batches = FileSender.pack_albums(file_paths) if pack else [[file_path] for file_path in file_paths]
         
-        async def send_with_semaphore(file_path):
-            async with semaphore:
-                return await FileSender.send_file_with_retry(client, chat_id, file_path)
+        async def send_with_limiter(batch):
+            async with limiter:
+                # Массовая отправка пропускает вперёд доставку авторам
+                with telegram_scheduler.lane("bulk"):
+                    return await FileSender.send_album_with_retry(client, chat_id, batch)
         
         # Создаем задачи для отправки файлов
-        tasks = [send_with_semaphore(file_path) for file_path in file_paths]
+        tasks = [send_with_limiter(batch) for batch in batches]
         
         # Выполняем с ограничением одновременных запросов
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
-        # Анализируем результаты
+        # Анализируем результаты по каждому файлу
         successful = 0
-        for file_path, result in zip(file_paths, results):
-            if result is True:
-                successful += 1
-            else:
-                print(f"Не удалось отправить файл: {file_path}")
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                result = [result] * len(batch)
+            for file_path, sent in zip(batch, result):
+                if sent is True:
+                    successful += 1
+                else:
+                    print(f"Не удалось отправить файл: {file_path}")
         
         print(f"Успешно отправлено: {successful}/{len(file_paths)} файлов")
         return successful
@@ -140,9 +862,1110 @@ class FileSender:
         
         return await FileSender.send_file_with_retry(client, chat_id, file_path)
 
+class DeadlineScheduler:
+    """Единый планировщик таймаутов: одна задача на все ожидающие future"""
+
+    def __init__(self):
+        self.heap = []  # (дедлайн, порядковый номер, future)
+        self.counter = itertools.count()
+        self.stale = 0  # Завершившиеся до дедлайна записи
+        self.wakeup = None
+        self.task = None
+
+    def schedule(self, future, timeout):
+        """Завершает future исключением asyncio.TimeoutError через timeout секунд"""
+        deadline = time.monotonic() + timeout
+        entry = (deadline, next(self.counter), future)
+        heapq.heappush(self.heap, entry)
+        future.add_done_callback(self._on_done)
+
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+        elif self.heap[0] is entry:
+            # Новый дедлайн раньше текущего — будим планировщик
+            self.wakeup.set()
+
+    def _on_done(self, future):
+        self.stale += 1
+        # Чистим кучу, когда в ней больше половины уже завершённых записей
+        if self.stale > 1024 and self.stale * 2 > len(self.heap):
+            self.heap = [entry for entry in self.heap if not entry[2].done()]
+            heapq.heapify(self.heap)
+            self.stale = 0
+
+    async def _run(self):
+        while self.heap:
+            deadline, _, future = self.heap[0]
+            if future.done():
+                heapq.heappop(self.heap)
+                self.stale = max(self.stale - 1, 0)
+                continue
+
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                heapq.heappop(self.heap)
+                future.set_exception(asyncio.TimeoutError())
+                continue
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+deadlines = DeadlineScheduler()
+
+
+class ReplyDispatcher:
+    """Диспетчер входящих сообщений: будит ожидающих сразу по событию on_message"""
+
+    def __init__(self, client, history_size=50, watch_size=256, watch_ttl=3600):
+        self.client = client
+        # chat -> [(id отправленного сообщения, предикат, future)]
+        self.waiters = defaultdict(list)
+        # Чаты, в которых недавно чего-то ждали: только для них запоминаются ранние ответы
+        self.watched = TTLCache(watch_size, watch_ttl)
+        # Сообщения, пришедшие раньше, чем кто-то начал их ждать
+        self.recent = defaultdict(lambda: deque(maxlen=history_size))
+        client.add_handler(MessageHandler(self._on_message, filters.incoming), group=-1)
+
+    @staticmethod
+    def chat_keys(chat):
+        """Ключи чата: id и username в нижнем регистре"""
+        keys = [chat.id]
+        if chat.username:
+            keys.append(chat.username.lower())
+        return keys
+
+    @staticmethod
+    def chat_key(chat):
+        return chat.lower() if isinstance(chat, str) else chat
+
+    def expect(self, chat, predicate, after_id=0):
+        """
+        Регистрирует ожидание сообщения в чате chat, пришедшего после after_id.
+        Возвращает future, который завершится самим сообщением.
+        """
+        key = self.chat_key(chat)
+        future = asyncio.get_running_loop().create_future()
+        self._watch(key)
+
+        # Ответ мог прийти раньше регистрации
+        for message in list(self.recent[key]):
+            if message.id > after_id and predicate(message):
+                self._forget(message)
+                future.set_result(message)
+                return future
+
+        waiter = (after_id, predicate, future)
+        self.waiters[key].append(waiter)
+        future.add_done_callback(lambda _: self.waiters[key].remove(waiter))
+        return future
+
+    async def wait(self, chat, predicate, after_id=0, timeout=300):
+        """Ожидание сообщения без опроса истории чата"""
+        future = self.expect(chat, predicate, after_id)
+        if not future.done():
+            deadlines.schedule(future, timeout)
+        try:
+            return await future
+        except asyncio.TimeoutError:
+            return None
+
+    def _watch(self, key):
+        """Продлевает наблюдение за чатом и выбрасывает буферы чатов, за которыми больше не следим"""
+        self.watched.add(key)
+        for stale in [k for k in self.recent if k not in self.watched]:
+            del self.recent[stale]
+
+    def _forget(self, message):
+        for key in self.chat_keys(message.chat):
+            recent = self.recent.get(key)
+            if recent and message in recent:
+                recent.remove(message)
+
+    async def _on_message(self, client, message):
+        keys = self.chat_keys(message.chat)
+        for key in keys:
+            waiters = self.waiters.get(key)
+            if not waiters:
+                continue
+
+            # Сначала ожидающий, на чьё сообщение пришёл ответ, затем остальные по очереди
+            candidates = sorted(
+                (w for w in waiters if w[0] < message.id),
+                key=lambda w: w[0] != message.reply_to_message_id
+            )
+            for _, predicate, future in candidates:
+                if future.done() or not predicate(message):
+                    continue
+                future.set_result(message)
+                self._watch(key)
+                return
+
+        for key in keys:
+            if key in self.watched:
+                self.recent[key].append(message)
+
+
+class TTLCache:
+    """Множество ключей с ограничением по времени жизни и размеру (вытесняются самые старые)"""
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()  # ключ -> время добавления
+
+    def add(self, key):
+        self.items[key] = time.monotonic()
+        self.items.move_to_end(key)
+        self._evict()
+
+    def __contains__(self, key):
+        added = self.items.get(key)
+        if added is None:
+            return False
+        if time.monotonic() - added > self.ttl:
+            del self.items[key]
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.items)
+
+    def clear(self):
+        self.items.clear()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self.items:
+            key, added = next(iter(self.items.items()))
+            if len(self.items) <= self.maxsize and now - added <= self.ttl:
+                break
+            self.items.popitem(last=False)
+
+
+class AlbumAggregator:
+    """
+    Собирает сообщения медиагруппы прямо из входящих обновлений
+    и передаёт группу обработчику после короткой паузы без новых сообщений.
+    """
+
+    def __init__(self, callback, idle=0.5, seen_size=10000, seen_ttl=24 * 3600):
+        self.callback = callback
+        self.idle = idle
+        self.groups = {}  # media_group_id -> сообщения
+        self.timers = {}  # media_group_id -> таймер сброса
+        self.seen = TTLCache(seen_size, seen_ttl)  # уже обработанные группы
+        self.tasks = set()
+
+    def add(self, message):
+        group_id = message.media_group_id
+        if group_id in self.seen:
+            return
+
+        self.groups.setdefault(group_id, []).append(message)
+        timer = self.timers.pop(group_id, None)
+        if timer is not None:
+            timer.cancel()
+        self.timers[group_id] = asyncio.get_running_loop().call_later(self.idle, self._flush, group_id)
+
+    def _flush(self, group_id):
+        self.timers.pop(group_id, None)
+        album = sorted(self.groups.pop(group_id, []), key=lambda msg: msg.id)
+        self.seen.add(group_id)
+        if not album:
+            return
+
+        task = asyncio.create_task(self.callback(album))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def clear(self):
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        self.groups.clear()
+        self.seen.clear()
+
+
+class ByteBudget:
+    """Общий на процесс лимит байт, одновременно находящихся в пересылке"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = None
+
+    async def acquire(self, size):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            # Файл больше всего лимита пропускаем, только когда больше ничего не летит
+            await self.condition.wait_for(
+                lambda: self.in_flight == 0 or self.in_flight + size <= self.limit)
+            self.in_flight += size
+
+    async def release(self, size):
+        async with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+
+class SpooledBuffer(io.IOBase):
+    """
+    Буфер в памяти, который при превышении порога уходит во временный файл.
+    pyrogram принимает для загрузки только io.IOBase, а SpooledTemporaryFile
+    наследует его лишь с Python 3.11, поэтому буфер оборачивает его, а не наследует.
+    """
+
+    def __init__(self, name, max_size):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self.file_name = name
+
+    @property
+    def name(self):
+        # pyrogram берёт имя документа из атрибута name
+        return self.file_name
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+relay_spool_threshold = config('RELAY_SPOOL_THRESHOLD', default=8 * 1024 * 1024, cast=int)
+relay_budget = ByteBudget(config('RELAY_BYTE_BUDGET', default=256 * 1024 * 1024, cast=int))
+relay_download_concurrency = config('RELAY_DOWNLOAD_CONCURRENCY', default=4, cast=int)
+
+
+class RelayStats:
+    """Статистика пересылки: каким путём ушёл каждый файл"""
+
+    PATHS = ("copy", "file_id", "bytes")
+
+    def __init__(self):
+        self.files = defaultdict(int)
+        self.bytes = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def record(self, path, messages, elapsed):
+        self.files[path] += len(messages)
+        self.bytes[path] += sum(msg.document.file_size or 0 for msg in messages)
+        self.seconds[path] += elapsed
+
+    def report(self):
+        """Сводка по путям пересылки"""
+        lines = []
+        for path in self.PATHS:
+            if not self.files[path]:
+                continue
+            avg = self.seconds[path] / self.files[path]
+            lines.append(f"{path}: {self.files[path]} файлов, {self.bytes[path] / 1024 / 1024:.1f} МБ, "
+                         f"в среднем {avg:.2f} сек на файл")
+
+        # Серверные пути не гоняют байты через нас: ни скачивания, ни повторной загрузки
+        saved = self.bytes["copy"] + self.bytes["file_id"]
+        lines.append(f"Сэкономлено трафика: {saved * 2 / 1024 / 1024:.1f} МБ")
+        return "\n".join(lines)
+
+
+class RelayEngine:
+    """
+    Пересылка документов между аккаунтами.
+    Сначала серверные пути (copy_message или отправка по file_id),
+    скачивание и повторная загрузка — только если они не сработали.
+    """
+
+    def __init__(self, file_id_retry=24 * 3600):
+        self.stats = RelayStats()
+        self.download_slots = {}  # Ограничение одновременных скачиваний на аккаунт
+        # Пары (src, dst), где отправка по file_id не сработала: file_id принадлежит аккаунту,
+        # который его получил, поэтому между разными аккаунтами путь пробуется редко
+        self.file_id_failed = TTLCache(ttl=file_id_retry)
+
+    async def relay_document(self, src, dst, chat_id, message):
+        """Пересылает один документ от имени клиента dst"""
+        return await self._relay(src, dst, chat_id, [message])
+
+    async def relay_album(self, src, dst, chat_id, messages):
+        """Пересылает документы одной медиагруппой от имени клиента dst"""
+        return await self._relay(src, dst, chat_id, messages)
+
+    async def _relay(self, src, dst, chat_id, messages):
+        paths = [("bytes", self._send_by_bytes)]
+        if (src, dst) not in self.file_id_failed:
+            paths.insert(0, ("file_id", self._send_by_file_id))
+        if src is dst:
+            # Сообщение доступно тому же аккаунту — копируем без скачивания.
+            # forward_messages не используем: он раскрывает исходного отправителя
+            paths.insert(0, ("copy", self._send_by_copy))
+
+        for path, send in paths:
+            started = time.monotonic()
+            try:
+                result = await send(src, dst, chat_id, messages)
+            except FloodWait:
+                raise
+            except Exception as e:
+                print(Fore.YELLOW + f"Путь пересылки {path} недоступен: {e}" + Style.RESET_ALL)
+                if path == "file_id":
+                    self.file_id_failed.add((src, dst))
+                continue
+
+            self.stats.record(path, messages, time.monotonic() - started)
+            print(Fore.CYAN + f"Переслано {len(messages)} файлов путём {path}" + Style.RESET_ALL)
+            return result
+
+        raise Exception("Не удалось переслать файлы ни одним из путей")
+
+    @staticmethod
+    async def _send_by_copy(src, dst, chat_id, messages):
+        first = messages[0]
+        if len(messages) == 1:
+            return [await dst.copy_message(chat_id, first.chat.id, first.id)]
+        return await dst.copy_media_group(chat_id, first.chat.id, first.id)
+
+    @staticmethod
+    async def _send_by_file_id(src, dst, chat_id, messages):
+        if len(messages) == 1:
+            return [await dst.send_document(chat_id=chat_id, document=messages[0].document.file_id)]
+        media = [InputMediaDocument(media=msg.document.file_id) for msg in messages]
+        return await dst.send_media_group(chat_id=chat_id, media=media)
+
+    async def _download(self, client, msg):
+        """Скачивает документ потоком в буфер с ограничением по аккаунту"""
+        if client not in self.download_slots:
+            self.download_slots[client] = asyncio.Semaphore(relay_download_concurrency)
+
+        file_buffer = SpooledBuffer(msg.document.file_name, relay_spool_threshold)
+        try:
+            async with self.download_slots[client]:
+                # Куски потока пишем сразу в буфер, который и уходит на загрузку
+                async for chunk in client.stream_media(msg):
+                    file_buffer.write(chunk)
+            # get_file глотает ошибки передачи, и поток просто обрывается раньше времени
+            if msg.document.file_size and file_buffer.tell() != msg.document.file_size:
+                raise ConnectionError(f"скачано {file_buffer.tell()} из {msg.document.file_size} байт "
+                                      f"файла {msg.document.file_name}")
+        except BaseException:
+            file_buffer.close()
+            raise
+        file_buffer.seek(0)
+        return file_buffer
+
+    async def _send_by_bytes(self, src, dst, chat_id, messages):
+        size = sum(msg.document.file_size or 0 for msg in messages)
+        await relay_budget.acquire(size)
+        buffers = []
+        try:
+            # Файлы альбома качаются параллельно, gather сохраняет их порядок
+            results = await asyncio.gather(*(self._download(src, msg) for msg in messages),
+                                           return_exceptions=True)
+            buffers = [fb for fb in results if not isinstance(fb, BaseException)]
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+
+            if len(buffers) == 1:
+                return [await dst.send_document(chat_id=chat_id, document=buffers[0])]
+            media = [InputMediaDocument(media=fb) for fb in buffers]
+            return await dst.send_media_group(chat_id=chat_id, media=media)
+        finally:
+            for fb in buffers:
+                fb.close()
+            await relay_budget.release(size)
+
+
+class FilesDB:
+    """
+    Асинхронный доступ к files.db: одно соединение в режиме WAL в отдельном потоке.
+    Записи, пришедшие в течение commit_window, фиксируются одной транзакцией.
+    """
+
+    def __init__(self, path="files.db", commit_window=0.01):
+        self.path = path
+        self.commit_window = commit_window
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="files-db")
+        self.conn = None
+        self.pending = []  # (sql, [параметры], future)
+        self.flush_task = None
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (username TEXT, filename TEXT)")
+            # Одна запись на пару автор-файл: убираем старые дубли перед уникальным индексом
+            self.conn.execute("""DELETE FROM files WHERE rowid NOT IN
+                                 (SELECT MIN(rowid) FROM files GROUP BY username, filename)""")
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS files_username_filename ON files (username, filename)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_filename ON files (filename)")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                 id TEXT PRIMARY KEY, kind TEXT, state TEXT, account TEXT, chat_id INTEGER,
+                                 message_ids TEXT, author TEXT, target TEXT, filenames TEXT,
+                                 attempts INTEGER DEFAULT 0, error TEXT, updated REAL)""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_state_author ON jobs (state, author)")
+            self.conn.commit()
+        return self.conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def fetchone(self, sql, params=()):
+        return await self._run(lambda: self._connect().execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self._run(lambda: self._connect().execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        """Запись одной строки, возвращается после коммита"""
+        await self.executemany(sql, [params])
+
+    async def executemany(self, sql, rows):
+        """Запись нескольких строк, возвращается после коммита"""
+        await self.submit(sql, rows)
+
+    def submit(self, sql, rows):
+        """
+        Ставит запись в очередь, не дожидаясь коммита.
+        Порядок записей сохраняется; возвращает future коммита.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((sql, list(rows), future))
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush())
+        return future
+
+    async def _flush(self):
+        while self.pending:
+            # Копим записи короткое окно, чтобы закоммитить их вместе
+            await asyncio.sleep(self.commit_window)
+            batch, self.pending = self.pending, []
+            try:
+                errors = await self._run(self._commit, batch)
+            except Exception as e:
+                errors = [e] * len(batch)
+
+            for (_, _, future), error in zip(batch, errors):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    def _commit(self, batch):
+        conn = self._connect()
+        try:
+            with conn:
+                for sql, rows, _ in batch:
+                    conn.executemany(sql, rows)
+            return [None] * len(batch)
+        except Exception:
+            pass
+
+        # Пачка откатилась — коммитим записи по одной, чтобы ошибка досталась только виновной
+        errors = []
+        for sql, rows, _ in batch:
+            try:
+                with conn:
+                    conn.executemany(sql, rows)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    async def close(self):
+        if self.flush_task is not None:
+            await self.flush_task
+        if self.conn is not None:
+            await self._run(self.conn.close)
+            self.conn = None
+
+
+class AhoCorasick:
+    """
+    Автомат Ахо-Корасик по нормализованным именам ожидающих файлов.
+    Один проход по тексту находит все имена, которые в нём встречаются.
+    """
+
+    def __init__(self, patterns=()):
+        self.goto = [{}]  # узел -> {символ: узел}
+        self.fail = [0]
+        self.output = [None]  # имя файла, которое заканчивается в узле
+        self.dict_link = [0]  # ближайший по fail-ссылкам узел с именем
+        self.nodes = {}  # имя файла -> узел
+        self.chars = 0  # суммарная длина имён в автомате
+        for pattern in patterns:
+            self._insert(pattern)
+        self._build()
+
+    @property
+    def sparse(self):
+        """В боре в основном узлы удалённых имён — пора пересобрать"""
+        return len(self.goto) > 1024 and len(self.goto) > 4 * self.chars
+
+    def remove(self, pattern):
+        node = self.nodes.pop(pattern, None)
+        if node is None:
+            return
+        # Структура бора не меняется, поэтому fail-ссылки остаются верными
+        self.output[node] = None
+        self.chars -= len(pattern)
+
+    def _insert(self, pattern):
+        if pattern in self.nodes:
+            return
+        node = 0
+        for char in pattern:
+            nxt = self.goto[node].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(None)
+                self.dict_link.append(0)
+            node = nxt
+        self.output[node] = pattern
+        self.nodes[pattern] = node
+        self.chars += len(pattern)
+
+    def _build(self):
+        queue_ = deque()
+        for node in self.goto[0].values():
+            self.fail[node] = 0
+            self.dict_link[node] = 0
+            queue_.append(node)
+
+        while queue_:
+            node = queue_.popleft()
+            for char, child in self.goto[node].items():
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                fail = self.goto[state].get(char, 0)
+                self.fail[child] = fail if fail != child else 0
+                self.dict_link[child] = fail if self.output[fail] is not None else self.dict_link[fail]
+                queue_.append(child)
+
+    def search(self, text):
+        """Множество имён файлов, встречающихся в text"""
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+
+            match = node
+            while match:
+                if self.output[match] is not None:
+                    found.add(self.output[match])
+                match = self.dict_link[match]
+        return found
+
+
+class PatternMatcher:
+    """
+    Поиск ожидающих файлов в тексте: автомат Ахо-Корасик плюс буфер новых имён,
+    которые проверяются напрямую. Когда буфер дорастёт до доли автомата, новый автомат
+    собирается в фоновом потоке и подменяет старый — add() не ждёт пересборки.
+    """
+
+    def __init__(self):
+        self.automaton = AhoCorasick()
+        self.fresh = set()  # имена, ещё не влитые в автомат
+        self.rebuilding = False
+        self.removed = set()  # имена, удалённые во время фоновой сборки
+        self.built = None  # готовый автомат из фонового потока
+
+    def __len__(self):
+        self._install()
+        return len(self.automaton.nodes) + len(self.fresh)
+
+    def add(self, pattern):
+        self._install()
+        self.removed.discard(pattern)
+        if not pattern or pattern in self.automaton.nodes or pattern in self.fresh:
+            return
+        self.fresh.add(pattern)
+        if len(self.fresh) > max(64, len(self.automaton.nodes) // 16):
+            self._rebuild()
+
+    def update(self, patterns):
+        """Массовое добавление имён одной сборкой автомата (при загрузке таблицы маршрутов)"""
+        self._install()
+        self.fresh.update(p for p in patterns if p and p not in self.automaton.nodes)
+        if not self.rebuilding:
+            self.automaton = AhoCorasick(list(self.automaton.nodes) + list(self.fresh))
+            self.fresh.clear()
+
+    def remove(self, pattern):
+        self._install()
+        if self.rebuilding:
+            self.removed.add(pattern)
+        self.fresh.discard(pattern)
+        self.automaton.remove(pattern)
+        if self.automaton.sparse:
+            self._rebuild()
+
+    def search(self, text):
+        """Множество имён файлов, встречающихся в text"""
+        self._install()
+        found = {pattern for pattern in self.fresh if pattern in text}
+        return found | self.automaton.search(text)
+
+    def _rebuild(self):
+        """Запускает сборку автомата по всем текущим именам в фоновом потоке"""
+        if self.rebuilding:
+            return
+        self.rebuilding = True
+        patterns = list(self.automaton.nodes) + list(self.fresh)
+        threading.Thread(target=self._build_in_background, args=(patterns,), daemon=True).start()
+
+    def _build_in_background(self, patterns):
+        self.built = AhoCorasick(patterns)
+
+    def _install(self):
+        """Подменяет автомат собранным в фоне, если он готов; вызывается только из основного потока"""
+        automaton = self.built
+        if automaton is None:
+            return
+        self.built = None
+        self.rebuilding = False
+        for pattern in self.removed:
+            automaton.remove(pattern)
+        self.removed.clear()
+        self.automaton = automaton
+        self.fresh.difference_update(automaton.nodes)
+        if len(self.fresh) > max(64, len(automaton.nodes) // 16) or automaton.sparse:
+            self._rebuild()
+
+
+class TrigramIndex:
+    """
+    Нечёткий поиск ожидающего файла по триграммам нормализованного имени.
+    Находит файл, к имени которого редактор что-то дописал («_испр», «v2»),
+    но не путает соседние файлы вроде «glava1» и «glava2».
+    """
+
+    MAX_POSTING = 64  # триграммы, общие для большего числа имён, кандидатов не порождают
+    DIGITS_RE = re.compile(r'\d+')
+
+    def __init__(self, threshold=0.7, margin=0.1):
+        self.threshold = threshold
+        self.margin = margin  # насколько лучший кандидат должен опережать второго
+        self.postings = defaultdict(set)  # триграмма -> имена
+        self.grams = {}  # имя -> его триграммы
+
+    @staticmethod
+    def trigrams(name):
+        padded = f"$${name}$"
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, name):
+        if not name or name in self.grams:
+            return
+        grams = self.trigrams(name)
+        self.grams[name] = grams
+        for gram in grams:
+            self.postings[gram].add(name)
+
+    def remove(self, name):
+        grams = self.grams.pop(name, None)
+        if grams is None:
+            return
+        for gram in grams:
+            names = self.postings[gram]
+            names.discard(name)
+            if not names:
+                del self.postings[gram]
+
+    def candidates(self, grams):
+        """
+        Имена, которые могут набрать порог. Имени с коэффициентом Дайса не ниже порога нужно
+        хотя бы need общих триграмм, поэтому оно встречается среди len(grams) - need + 1
+        самых редких триграмм запроса — остальные списки можно не обходить.
+        """
+        shortest = math.ceil(len(grams) * self.threshold / (2 - self.threshold))
+        need = math.ceil(self.threshold * (len(grams) + shortest) / 2)
+        rarest = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        found = set()
+        for names in rarest[:len(grams) - need + 1]:
+            if len(names) > self.MAX_POSTING:
+                # Имя, которое отличается от тысяч других только общими триграммами,
+                # всё равно не пройдёт проверку отрыва от второго кандидата
+                break
+            found.update(names)
+        return found
+
+    def ranked(self, name, limit=3):
+        """Лучшие совпадения [(коэффициент Дайса, имя)] по убыванию сходства"""
+        grams = self.trigrams(name)
+        scores = [(2 * len(grams & self.grams[candidate]) / (len(grams) + len(self.grams[candidate])), candidate)
+                  for candidate in self.candidates(grams)]
+        return heapq.nlargest(limit, scores)
+
+    def compatible(self, name, candidate):
+        """
+        Номера в имени ожидающего файла совпадают с первыми номерами в имени от редактора:
+        «glava1» -> «glava1v2» подходит, «glava1» -> «glava2» и «rabota5» -> «rabota50» — нет
+        """
+        numbers = self.DIGITS_RE.findall(candidate)
+        return self.DIGITS_RE.findall(name)[:len(numbers)] == numbers
+
+    def best(self, name):
+        """
+        Самое похожее совместимое имя, если сходство не ниже порога
+        и заметно выше, чем у следующего кандидата, иначе None
+        """
+        ranked = [(score, candidate) for score, candidate in self.ranked(name, limit=len(self.grams))
+                  if self.compatible(name, candidate)]
+        if not ranked or ranked[0][0] < self.threshold:
+            return None
+        if len(ranked) > 1 and ranked[0][0] - ranked[1][0] < self.margin:
+            return None
+        return ranked[0][1]
+
+
+class RoutingTable:
+    """
+    Маршруты файлов от редактора к авторам: словарь в памяти по нормализованному имени файла.
+    Таблица files — его копия, изменения пишутся в неё в фоне.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.authors = {}  # имя файла -> авторы в порядке поступления
+        self.pending = 0
+        self.matcher = PatternMatcher()
+        self.fuzzy = TrigramIndex(config('FUZZY_MATCH_THRESHOLD', default=0.7, cast=float),
+                                  config('FUZZY_MATCH_MARGIN', default=0.1, cast=float))
+
+    async def load(self):
+        """Восстанавливает таблицу маршрутов из files"""
+        self.authors.clear()
+        self.pending = 0
+        self.matcher = PatternMatcher()
+        self.fuzzy = TrigramIndex(self.fuzzy.threshold, self.fuzzy.margin)
+        rows = await self.db.fetchall("SELECT username, filename FROM files ORDER BY rowid")
+        self.matcher.update(filename for _, filename in rows)
+        for username, filename in rows:
+            self._add(username, filename)
+
+    def _add(self, username, filename):
+        if filename not in self.authors:
+            self.matcher.add(filename)
+            self.fuzzy.add(filename)
+        authors = self.authors.setdefault(filename, [])
+        if username in authors:
+            return False
+        authors.append(username)
+        self.pending += 1
+        return True
+
+    def add(self, username, filename):
+        """Запоминает, что файл filename ждёт автор username"""
+        if self._add(username, filename):
+            self._write_behind("INSERT OR IGNORE INTO files (username, filename) VALUES (?, ?)",
+                               [(username, filename)])
+
+    def author(self, filename):
+        """Автор файла; при совпадении имён — тот, кто прислал файл раньше"""
+        authors = self.authors.get(filename)
+        return authors[0] if authors else None
+
+    def resolve(self, filename):
+        """
+        (имя ожидающего файла, автор) для файла от редактора.
+        Сначала точное совпадение, затем самое похожее имя выше порога.
+        """
+        author = self.author(filename)
+        if author:
+            return filename, author
+
+        match = self.fuzzy.best(filename)
+        if match is None:
+            return None
+        print(Fore.YELLOW + f"Файл {filename} сопоставлен с ожидающим {match}" + Style.RESET_ALL)
+        return match, self.author(match)
+
+    def remove(self, username, filename):
+        authors = self.authors.get(filename)
+        if not authors or username not in authors:
+            return
+        authors.remove(username)
+        if not authors:
+            del self.authors[filename]
+            self.matcher.remove(filename)
+            self.fuzzy.remove(filename)
+        self.pending -= 1
+        self._write_behind("DELETE FROM files WHERE username = ? AND filename = ?", [(username, filename)])
+
+    def waiting(self, username, filename):
+        """Ждёт ли автор username файл filename"""
+        return username in self.authors.get(filename, ())
+
+    def items(self):
+        """Пары (имя файла, автор) всех ожидающих файлов"""
+        return [(filename, username) for filename, authors in self.authors.items() for username in authors]
+
+    def find_in(self, text):
+        """Пары (имя файла, автор) для всех ожидающих файлов, упомянутых в text"""
+        return [(filename, username) for filename in self.matcher.search(text)
+                for username in self.authors[filename]]
+
+    @property
+    def empty(self):
+        return self.pending == 0
+
+    def _write_behind(self, sql, rows):
+        future = self.db.submit(sql, rows)
+        future.add_done_callback(self._on_written)
+
+    @staticmethod
+    def _on_written(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(Fore.RED + f"Ошибка записи в files.db: {future.exception()}" + Style.RESET_ALL)
+
+
+class JobQueue:
+    """
+    Очередь задач mode_3 в таблице jobs файла files.db.
+    Обработчики Telegram только ставят задачи, пул воркеров их выполняет,
+    а незавершённые задачи после перезапуска продолжаются с сохранённого шага.
+
+    Файл автора: relay -> awaiting -> done (done — когда редактор вернул все файлы задачи).
+    Ответ редактора: deliver -> done.
+    """
+
+    ACTIVE = ("relay", "deliver")
+    COLUMNS = ("id", "kind", "state", "account", "chat_id", "message_ids",
+               "author", "target", "filenames", "attempts")
+
+    def __init__(self, db, workers=4, max_attempts=5, keep_days=7, account_retry=60, write_retry=5):
+        self.db = db
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.keep_days = keep_days
+        self.account_retry = account_retry  # через сколько секунд проверить, запустился ли аккаунт задачи
+        self.write_retry = write_retry
+        self.handlers = {}  # состояние -> корутина(job), возвращающая следующее состояние
+        self.jobs = {}  # id -> задача в работе
+        self.messages = {}  # id -> сообщения задачи, пока они есть в памяти
+        self.known = set()  # id всех задач в таблице, для идемпотентной постановки
+        self.queue = asyncio.Queue()
+        self.tasks = []
+        self.timers = []
+
+    @staticmethod
+    def job_id(account, message):
+        """Одно и то же сообщение на одном аккаунте всегда даёт одну задачу"""
+        return f"{account}:{message.chat.id}:{message.id}"
+
+    def _job(self, row):
+        job = dict(zip(self.COLUMNS, row))
+        job["message_ids"] = json.loads(job["message_ids"])
+        job["filenames"] = json.loads(job["filenames"] or "[]")
+        return job
+
+    async def load(self):
+        """Читает таблицу jobs и возвращает в очередь незавершённые задачи"""
+        cutoff = time.time() - self.keep_days * 24 * 3600
+        await self.db.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND updated < ?", (cutoff,))
+        self.known = {job_id for job_id, in await self.db.fetchall("SELECT id FROM jobs")}
+        rows = await self.db.fetchall(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE state IN ('relay', 'deliver') ORDER BY rowid")
+        for row in rows:
+            job = self._job(row)
+            self.jobs[job["id"]] = job
+            self.queue.put_nowait(job["id"])
+        return len(rows)
+
+    async def enqueue(self, kind, state, account, messages, author=None, target=None, filenames=()):
+        """
+        Сохраняет задачу и ставит её в очередь; возвращается после коммита.
+        Повторная постановка тех же сообщений ничего не делает и возвращает False.
+        """
+        job_id = self.job_id(account, messages[0])
+        if job_id in self.known:
+            return False
+        self.known.add(job_id)
+
+        job = {"id": job_id, "kind": kind, "state": state, "account": account,
+               "chat_id": messages[0].chat.id, "message_ids": [msg.id for msg in messages],
+               "author": author, "target": target, "filenames": list(filenames), "attempts": 0}
+        try:
+            await self.db.execute(
+                "INSERT OR IGNORE INTO jobs (id, kind, state, account, chat_id, message_ids, author, target, "
+                "filenames, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, state, account, job["chat_id"], json.dumps(job["message_ids"]),
+                 author, target, json.dumps(job["filenames"], ensure_ascii=False), time.time()))
+        except Exception:
+            self.known.discard(job_id)
+            raise
+
+        self.jobs[job_id] = job
+        self.messages[job_id] = messages
+        self.queue.put_nowait(job_id)
+        return True
+
+    async def fetch(self, client, job):
+        """Сообщения задачи: из памяти, а после перезапуска — заново из Telegram"""
+        messages = self.messages.get(job["id"])
+        if messages is None:
+            messages = await client.get_messages(job["chat_id"], job["message_ids"])
+            messages = [msg for msg in messages if not msg.empty]
+            self.messages[job["id"]] = messages
+        return messages
+
+    async def settle(self, author, waiting):
+        """Завершает задачи автора в awaiting, по которым не осталось ожидаемых файлов"""
+        rows = await self.db.fetchall("SELECT id, filenames FROM jobs WHERE state = 'awaiting' AND author = ?",
+                                      (author,))
+        done = [(time.time(), job_id) for job_id, filenames in rows
+                if not any(waiting(author, filename) for filename in json.loads(filenames))]
+        if done:
+            await self.db.executemany("UPDATE jobs SET state = 'done', updated = ? WHERE id = ?", done)
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Останавливает воркеров; прерванные задачи продолжатся при следующем load()"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for timer in self.timers:
+            timer.cancel()
+        self.tasks, self.timers = [], []
+        self.jobs.clear()
+        self.messages.clear()
+        self.queue = asyncio.Queue()
+
+    async def _worker(self):
+        while True:
+            job = self.jobs.get(await self.queue.get())
+            if job is None:
+                continue
+            # Шаг уже выполнен, но не записан в таблицу — повторяем только запись
+            state = job.pop("next", None)
+            if state is None:
+                try:
+                    state = await self.handlers[job["state"]](job)
+                except FloodWait as e:
+                    # Не ошибка задачи: повторяем, когда Telegram разрешит
+                    self._retry(job, e.value)
+                    continue
+                except AccountUnavailable as e:
+                    # Сообщения задачи есть только у её аккаунта: ждём его, попытку не считаем
+                    print(Fore.YELLOW + f"Задача {job['id']}: {e}, повтор через {self.account_retry} с"
+                          + Style.RESET_ALL)
+                    self._retry(job, self.account_retry)
+                    continue
+                except Exception as e:
+                    await self._failed(job, e)
+                    continue
+                job["error"] = None
+
+            await self._save(job, state)
+
+    async def _save(self, job, state):
+        """Записывает шаг задачи; если files.db недоступна, шаг остаётся в памяти и запись повторяется"""
+        try:
+            await self._advance(job, state)
+        except Exception as e:
+            print(Fore.RED + f"Ошибка записи задачи {job['id']} в files.db: {e}, повтор через "
+                  f"{self.write_retry} с" + Style.RESET_ALL)
+            job["next"] = state
+            self._retry(job, self.write_retry)
+
+    async def _advance(self, job, state):
+        await self.db.execute("UPDATE jobs SET state = ?, attempts = ?, error = ?, updated = ? WHERE id = ?",
+                              (state, job["attempts"], job.get("error"), time.time(), job["id"]))
+        job["state"] = state
+        if state in self.ACTIVE:
+            self.queue.put_nowait(job["id"])
+        else:
+            # Ждущие ответа задачи живут только в таблице, память освобождаем
+            self.jobs.pop(job["id"], None)
+            self.messages.pop(job["id"], None)
+
+    async def _failed(self, job, error):
+        job["attempts"] += 1
+        job["error"] = str(error)
+        if job["attempts"] >= self.max_attempts:
+            print(Fore.RED + f"Задача {job['id']} не выполнена после {job['attempts']} попыток: {error}"
+                  + Style.RESET_ALL)
+            await self._save(job, "failed")
+            return
+
+        print(Fore.YELLOW + f"Задача {job['id']}: {error}, повтор через {2 ** job['attempts']} с"
+              + Style.RESET_ALL)
+        self._retry(job, 2 ** job["attempts"])
+        try:
+            await self.db.execute("UPDATE jobs SET attempts = ?, error = ?, updated = ? WHERE id = ?",
+                                  (job["attempts"], job["error"], time.time(), job["id"]))
+        except Exception as e:
+            # Счётчик попыток остаётся в памяти и попадёт в таблицу со следующей записью задачи
+            print(Fore.RED + f"Ошибка записи задачи {job['id']} в files.db: {e}" + Style.RESET_ALL)
+
+    def _retry(self, job, delay):
+        loop = asyncio.get_running_loop()
+        self.timers = [timer for timer in self.timers if timer.when() > loop.time()]
+        self.timers.append(loop.call_later(delay, self.queue.put_nowait, job["id"]))
+
+    async def contacts(self):
+        """Пары (аккаунт, автор) из задач с файлами авторов"""
+        return await self.db.fetchall("SELECT DISTINCT account, author FROM jobs WHERE kind = 'intake'")
+
+    async def stats(self):
+        return dict(await self.db.fetchall("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    async def report(self):
+        stats = await self.stats()
+        return "Задачи: " + ", ".join(f"{state} {stats.get(state, 0)}"
+                                      for state in ("relay", "awaiting", "deliver", "done", "failed"))
+
+
+# Сколько ждать подключения аккаунта с сохранённой сессией
+client_start_timeout = config('CLIENT_START_TIMEOUT', default=60, cast=float)
+
+
 class App:
     def __init__(self):
         self.clients = {}  # Будем хранить клиентов здесь
+        self.dispatchers = {}  # Диспетчеры входящих сообщений по клиентам
+        self.pool = ClientPool(telegram_scheduler)
+        self.relay = RelayEngine()
+        self.db = FilesDB("files.db")
+        self.routes = RoutingTable(self.db)
+        self.jobs = JobQueue(self.db, workers=config('JOB_WORKERS', default=4, cast=int))
         self.clear_console()
 
     async def initialize(self):
@@ -151,30 +1974,77 @@ class App:
             self.check_env_file()
             return
 
-        for i in range(2):
-            client_name = f"client{i + 1}"
-            try:
-                print(Fore.YELLOW + f"Инициализация {client_name}..." + Style.RESET_ALL)
+        accounts = []
+        i = 1
+        while config(f'LOGIN{i}', default=None):
+            client_name = f"client{i}"
+            self.clients[client_name] = Client(
+                name=config(f'LOGIN{i}'),
+                api_id=config(f'API_ID{i}'),
+                api_hash=config(f'API_HASH{i}'),
+                phone_number=config(f'PHONE{i}'),
+                max_concurrent_transmissions=max(download_connections, upload_connections))
+            roles = config(f'ROLES{i}', default=ClientPool.default_roles(i)).replace(" ", "").split(",")
+            accounts.append((client_name, roles))
+            i += 1
+
+        # Аккаунты без сохранённой сессии спрашивают код в консоли — их запускаем по очереди,
+        # остальные подключаются одновременно
+        fresh = [account for account in accounts if not self.has_session(self.clients[account[0]])]
+        warm = [account for account in accounts if account not in fresh]
+        started = time.monotonic()
+        for client_name, roles in fresh:
+            await self.start_client(client_name, roles, timeout=None)
+        await asyncio.gather(*(self.start_client(client_name, roles) for client_name, roles in warm))
+        print(Fore.CYAN + f"Аккаунты готовы за {time.monotonic() - started:.1f} с: "
+              f"{len(self.pool.clients)} из {len(accounts)}" + Style.RESET_ALL)
+
+        if not self.pool.clients:
+            print(Fore.RED + "Не удалось запустить ни один аккаунт" + Style.RESET_ALL)
+            await self.shutdown()
+            return False
 
-                self.clients[client_name] = Client(
-                    name=config(f'LOGIN{i + 1}'),
-                    api_id=config(f'API_ID{i + 1}'),
-                    api_hash=config(f'API_HASH{i + 1}'),
-                    phone_number=config(f'PHONE{i + 1}'))
+        missing = [role for role in ClientPool.ROLES if not self.pool.roles[role]]
+        if missing:
+            print(Fore.RED + f"Нет аккаунтов с ролями: {', '.join(missing)}. "
+                             f"Режимы, которым они нужны, будут недоступны" + Style.RESET_ALL)
 
-                await self.clients[client_name].start()
-                print(Fore.GREEN + f"{client_name} успешно инициализирован!" + Style.RESET_ALL)
+        return True
 
-            except Exception as e:
-                print(Fore.RED + f"Ошибка инициализации {client_name}:" + Style.RESET_ALL)
-                print(e)
-                await self.shutdown()
-                return False
+    @staticmethod
+    def has_session(client):
+        """Есть ли у клиента сохранённая сессия (старт без ввода кода)"""
+        return os.path.exists(os.path.join(client.workdir, f"{client.name}.session"))
+
+    async def start_client(self, client_name, roles, timeout=client_start_timeout):
+        """Запуск одного аккаунта; при ошибке или таймауте аккаунт просто не попадает в пул"""
+        client = self.clients[client_name]
+        print(Fore.YELLOW + f"Инициализация {client_name}..." + Style.RESET_ALL)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(client.start(), timeout)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                e = f"не подключился за {timeout:g} с"
+            print(Fore.RED + f"Ошибка инициализации {client_name}: {e}" + Style.RESET_ALL)
+            if client.is_connected:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+            return
 
-        return True
+        telegram_scheduler.attach(client, client_name)
+        self.dispatchers[client_name] = ReplyDispatcher(client)
+        self.pool.add(client_name, client, roles)
+        print(Fore.GREEN + f"{client_name} (@{client.me.username}) успешно инициализирован "
+                           f"за {time.monotonic() - started:.1f} с! Роли: {', '.join(roles)}" + Style.RESET_ALL)
 
     async def shutdown(self):
         """Корректное завершение работы всех клиентов"""
+        await self.db.close()
+        web.executor.shutdown(wait=False, cancel_futures=True)
+        web.pool.shutdown()
         for name, client in self.clients.items():
             try:
                 if isinstance(client, Client) and client.is_initialized:
@@ -193,12 +2063,17 @@ class App:
         """Создание .env файла"""
         print(Fore.RED + "Не внесены данные об аккаунтах Telegram")
         env_text = ""
-        for i in range(2):
+        count = input(Style.RESET_ALL + "Количество аккаунтов (по умолчанию 2): ")
+        for i in range(1, int(count or 2) + 1):
             print(Style.RESET_ALL + "---------------------------------")
-            env_text += f"API_ID{i + 1}=" + input(f"ID {i + 1} аккаунта: ") + "\n"
-            env_text += f"API_HASH{i + 1}=" + input(f"HASH {i + 1} аккаунта: ") + "\n"
-            env_text += f"LOGIN{i + 1}=" + input(f"username {i + 1} аккаунта без '@': ") + "\n"
-            env_text += f"PHONE{i + 1}=" + input(f"номер телефона {i + 1} аккаунта: ") + "\n"
+            env_text += f"API_ID{i}=" + input(f"ID {i} аккаунта: ") + "\n"
+            env_text += f"API_HASH{i}=" + input(f"HASH {i} аккаунта: ") + "\n"
+            env_text += f"LOGIN{i}=" + input(f"username {i} аккаунта без '@': ") + "\n"
+            env_text += f"PHONE{i}=" + input(f"номер телефона {i} аккаунта: ") + "\n"
+            default = ClientPool.default_roles(i)
+            roles = input(f"роли {i} аккаунта через запятую ({', '.join(ClientPool.ROLES)}), "
+                          f"по умолчанию {default}: ")
+            env_text += f"ROLES{i}=" + (roles or default) + "\n"
 
         with open(".env", "w") as f:
             f.write(env_text)
@@ -249,7 +2124,8 @@ class App:
         print(f"Редактор: @{self.editor}{Style.RESET_ALL}")
         print(f"Для остановки введите 'stop'{Style.RESET_ALL}")
 
-        client = self.clients['client1']
+        client = self.pool.first("intake")
+        self.pool.talked(self.pool.name_of(client), self.author)
 
         @client.on_message(filters.document & filters.private)
         async def handle_document(client, message):
@@ -294,7 +2170,7 @@ class App:
                 if i + 5 < len(documents):
                     await asyncio.sleep(2)
 
-        print(Fore.GREEN + f"Бот запущен как @{(await client.get_me()).username}")
+        print(Fore.GREEN + f"Бот запущен как @{client.me.username}")
         print(Fore.CYAN + "Ожидаю новые файлы от клиента..." + Style.RESET_ALL)
 
         async def console_input():
@@ -314,48 +2190,60 @@ class App:
         self.clear_console()
         print(Fore.YELLOW + "Мониторинг остановлен, возвращаемся в меню" + Style.RESET_ALL)
 
-    async def process_batch(self, batch, original_message):
-        """Обработка партии файлов с защитой от блокировки"""
-        client = self.clients['client1']
+    async def process_batch(self, batch, original_message, queue_size=1):
+        """
+        Обработка партии файлов конвейером: следующий файл скачивается,
+        пока предыдущий отправляется
+        """
+        client = self.pool.first("intake")
 
-        try:
-            # Создаем уникальную папку для этой партии
-            batch_dir = os.path.join("downloads", f"batch_{int(time.time())}")
-            os.makedirs(batch_dir, exist_ok=True)
+        # Создаем уникальную папку для этой партии
+        batch_dir = os.path.join("downloads", f"batch_{int(time.time())}")
+        os.makedirs(batch_dir, exist_ok=True)
 
-            # Обрабатываем файлы последовательно с задержками
-            for i, doc in enumerate(batch):
-                try:
+        # Ограниченная очередь между скачиванием и отправкой
+        downloaded = asyncio.Queue(maxsize=queue_size)
+
+        async def download_stage():
+            try:
+                for i, doc in enumerate(batch):
                     filename = f"doc_{i}_{doc.file_name}"
                     file_path = os.path.join(batch_dir, filename)
 
-                    # Шаг 1: Скачивание с уникальным временным именем
+                    # Скачивание с уникальным временным именем
                     temp_path = file_path + ".temp"
                     print(Fore.YELLOW + f"Скачивание {filename}..." + Style.RESET_ALL)
 
-                    await client.download_media(
-                        doc,
-                        file_name=temp_path,
-                        progress=self.download_progress,
-                        progress_args=(filename,)
-                    )
+                    try:
+                        await self.download_document(client, doc.file_id, doc.file_size, temp_path, filename)
+                        # Файл готов только после записи всех диапазонов
+                        os.rename(temp_path, file_path)
+                    except Exception as e:
+                        print(Fore.RED + f"Ошибка скачивания файла {filename}: {e}" + Style.RESET_ALL)
+                        self.safe_remove(temp_path)
+                        continue
 
-                    # Шаг 2: Переименование после завершения скачивания
-                    await asyncio.sleep(0.5)  # Задержка для гарантии завершения
-                    os.rename(temp_path, file_path)
+                    await downloaded.put((filename, file_path))
+            finally:
+                await downloaded.put(None)
 
-                    # Шаг 3: Обработка файла
+        async def send_stage():
+            while True:
+                item = await downloaded.get()
+                if item is None:
+                    break
+
+                filename, file_path = item
+                try:
                     print(Fore.CYAN + f"Обработка {filename}..." + Style.RESET_ALL)
                     await self.process_and_send_file(client, file_path, filename, original_message.caption)
-
-                    # Шаг 4: Очистка
-                    await asyncio.sleep(0.5)
-                    self.safe_remove(file_path)
-
                 except Exception as e:
                     print(Fore.RED + f"Ошибка обработки файла {filename}: {e}" + Style.RESET_ALL)
-                    continue
+                finally:
+                    self.safe_remove(file_path)
 
+        try:
+            await asyncio.gather(download_stage(), send_stage())
         except Exception as e:
             print(Fore.RED + f"Критическая ошибка партии: {e}" + Style.RESET_ALL)
         finally:
@@ -364,17 +2252,24 @@ class App:
 
     async def process_and_send_file(self, client, file_path, filename, caption):
         """Безопасная обработка и отправка файла"""
-        try:
-            # Создаем копию для отправки
-            send_path = file_path + ".send"
-            shutil.copyfile(file_path, send_path)
-
-            # Отправляем файл
-            await client.send_document(bot_name, send_path)
-            await self.process_single_file(send_path, filename, caption)
-
-        finally:
-            self.safe_remove(send_path)
+        # Отправляем скачанный файл без промежуточной копии
+        await client.send_document(bot_name, file_path)
+        await self.process_single_file(file_path, filename, caption)
+
+    async def download_document(self, client, media, file_size, path, filename):
+        """Скачивание документа параллельными диапазонами с общим прогрессом"""
+        if not file_size:
+            return await client.download_media(media, file_name=path, progress=self.download_progress,
+                                               progress_args=(filename,))
+        downloader = RangedDownloader(client, connections=download_connections)
+        return await downloader.download(media, file_size, path, progress=self.download_progress,
+                                         progress_args=(filename,))
+
+    def download_progress(self, current, total, filename):
+        """Вывод прогресса скачивания"""
+        if total:
+            end = "\n" if current >= total else ""
+            print(f"\r{filename}: {current * 100 / total:.1f}%", end=end)
 
     def safe_remove(self, path):
         """Безопасное удаление файла с несколькими попытками"""
@@ -421,7 +2316,8 @@ class App:
         print(f"Для остановки введите 'stop'{Style.RESET_ALL}")
 
         # Получаем клиента для мониторинга
-        client = self.clients['client1']
+        client = self.pool.first("intake")
+        self.pool.talked(self.pool.name_of(client), self.author)
 
         @client.on_message(filters.document & filters.private)
         async def handle_document(client, message):
@@ -443,12 +2339,14 @@ class App:
 
             # Скачивание файла
             os.makedirs("downloads", exist_ok=True)
-            path = await message.download(f"downloads/{message.document.file_name}")
+            path = await self.download_document(client, message, message.document.file_size,
+                                                f"downloads/{message.document.file_name}",
+                                                message.document.file_name)
             print(Fore.BLUE + f"Файл сохранен: {path}" + Style.RESET_ALL)
 
             await self.work_with_bot(path, message.document.file_name, self.author, message.caption)
 
-        print(Fore.GREEN + f"Бот запущен как @{(await client.get_me()).username}")
+        print(Fore.GREEN + f"Бот запущен как @{client.me.username}")
         print(Fore.CYAN + "Ожидаю новых файлов от клиента..." + Style.RESET_ALL)
 
         # Добавляем обработку команды stop из консоли
@@ -494,14 +2392,14 @@ class App:
             print(link_status)
         except:
             pass
-        client = self.clients['client1']
+        client = self.pool.first("bot")
 
         try:
             print(Fore.MAGENTA + f"Отправка файла {filename} боту @{bot_name}..." + Style.RESET_ALL)
-            await client.send_document(bot_name, file_path)
+            sent = await client.send_document(bot_name, file_path)
 
             # Ожидание ответа от бота с обработкой кнопки
-            response = await self.wait_for_bot_response()
+            response = await self.wait_for_bot_response(after_id=sent.id)
             if not response:
                 raise Exception("Бот не ответил")
 
@@ -516,14 +2414,13 @@ class App:
 
                             print(Fore.YELLOW + f"Cсылка получена успешно: {button.url}" + Style.RESET_ALL)
                             if link_status is not None and "ссылкой" in link_status:
-                                client = self.clients['client1']
                                 await client.send_message(recipient, button.url)
                             else:
                                 webs = web()
                                 if link_status is not None and "рерайт" in filename:
-                                    await webs.download_raport(button.url, filename, button.url, self.clients['client1'])
+                                    await webs.download_raport(button.url, filename, button.url, client, self.editor)
                                 else:
-                                    await webs.download_raport(button.url, filename, None, self.clients['client1'])
+                                    await webs.download_raport(button.url, filename, None, client, self.editor)
 
                             # Даем время на обработку
                             await asyncio.sleep(3)
@@ -537,16 +2434,16 @@ class App:
 
     async def send_to_editor(self, file_path, editor):
         author = self.author
-        client_editor = self.clients['client2']
-        client_author = self.clients['client1']
+        size = os.path.getsize(file_path)
 
         try:
-            # 1. Отправляем файл редактору и запоминаем время отправки
-            sent_message = await client_editor.send_document(
-                editor,
-                file_path,
-                caption="📎 Файл для проверки"
-            )
+            # 1. Отправляем файл редактору через самый свободный аккаунт и запоминаем время отправки
+            with self.pool.sender("editor", size) as client_editor:
+                sent_message = await client_editor.send_document(
+                    editor,
+                    file_path,
+                    caption="📎 Файл для проверки"
+                )
             request_time = sent_message.date  # Запоминаем время отправки
             print(Fore.GREEN + f"Файл отправлен редактору @{editor} в {request_time}" + Style.RESET_ALL)
 
@@ -554,13 +2451,15 @@ class App:
             edited_file_path = await self.wait_for_editor_response(
                 client_editor,
                 editor,
-                min_date=request_time
+                min_date=request_time,
+                after_id=sent_message.id
             )
             if not edited_file_path:
                 raise Exception("Редактор не отправил исправленный файл")
 
             # 3. Пересылаем файл автору
-            await client_author.send_document(author, edited_file_path)
+            with self.pool.sender("delivery", os.path.getsize(edited_file_path), author) as client_author:
+                await client_author.send_document(author, edited_file_path)
             print(Fore.GREEN + f"Файл переслан автору @{author}" + Style.RESET_ALL)
 
         except Exception as e:
@@ -573,249 +2472,173 @@ class App:
         print(f"\n{Fore.CYAN}=== Начинаем мониторинг ===")
         print(f"Отправитель (-и): @{authors}")
         print(f"Редактор: @{editor}{Style.RESET_ALL}")
-        print(f"Для остановки введите 'stop'{Style.RESET_ALL}")
+        print(f"Для остановки введите 'stop', для статистики очередей — 'stats'{Style.RESET_ALL}")
 
-        client = self.clients['client1']
-        client2 = self.clients['client2']
-        processed_media_groups = defaultdict(bool)
+        missing = [role for role in ("intake", "editor", "delivery") if not self.pool.roles[role]]
+        if missing:
+            print(Fore.RED + f"Для режима нужны аккаунты с ролями: {', '.join(missing)}" + Style.RESET_ALL)
+            return
+        await self.routes.load()
+        resumed = await self.jobs.load()
+        for account, author in await self.jobs.contacts():
+            self.pool.talked(account, author)
+        if resumed:
+            print(Fore.CYAN + f"Продолжаем незавершённые задачи: {resumed}" + Style.RESET_ALL)
+
+        def is_service_file(file_name):
+            name = file_name.lower()
+            return ("payment" in name or "receipt" in name or "document" in name and "выполнен" not in name
+                    or "документ" in name or "пэймент" in name)
+
+        async def relay_to_editor(job):
+            """Задача relay: файлы автора уходят редактору, маршруты запоминаются"""
+            client = self.pool.get(job["account"])
+            messages = await self.jobs.fetch(client, job)
+            if not messages:
+                print(Fore.RED + f"Сообщения задачи {job['id']} удалены" + Style.RESET_ALL)
+                return "failed"
+
+            size = sum(msg.document.file_size or 0 for msg in messages)
+            with self.pool.sender("editor", size) as client2:
+                if len(messages) == 1:
+                    await self.relay.relay_document(client, client2, job["target"], messages[0])
+                else:
+                    await self.relay.relay_album(client, client2, job["target"], messages)
+            print(Fore.GREEN + f"Успешно отправлено редактору файлов: {len(messages)}" + Style.RESET_ALL)
+
+            for filename in job["filenames"]:
+                self.routes.add(job["author"], filename)
+            return "awaiting"
+
+        async def deliver_to_authors(job):
+            """Задача deliver: ответ редактора уходит авторам ожидающих файлов"""
+            client2 = self.pool.get(job["account"])
+            messages = await self.jobs.fetch(client2, job)
+
+            # Группируем файлы по авторам, сообщения об ошибках — по упомянутым файлам
+            author_files = defaultdict(list)
+            notices = []
+            for msg in messages:
+                if msg.document:
+                    route = self.routes.resolve(normalize_name(os.path.splitext(msg.document.file_name)[0]))
+                    if route:
+                        filename, author = route
+                        author_files[author].append((msg, filename))
+                else:
+                    error_text = msg.caption if msg.photo else msg.text
+                    notices.extend((filename, username, error_text)
+                                   for filename, username in self.routes.find_in(normalize_name(error_text)))
+
+            # Уже доставленные файлы убираются из маршрутов сразу, поэтому повтор задачи их не дублирует
+            for author, files in author_files.items():
+                size = sum(msg.document.file_size or 0 for msg, _ in files)
+                with telegram_scheduler.lane("delivery"), self.pool.sender("delivery", size, author) as client:
+                    if len(files) == 1:
+                        await self.relay.relay_document(client2, client, author, files[0][0])
+                    else:
+                        await self.relay.relay_album(client2, client, author, [msg for msg, _ in files])
+                print(Fore.GREEN + f"Отправлено {len(files)} файлов автору {author}" + Style.RESET_ALL)
+
+                for _, filename in files:
+                    self.routes.remove(author, filename)
+                await self.jobs.settle(author, self.routes.waiting)
+
+            for filename, username, error_text in notices:
+                with telegram_scheduler.lane("delivery"), self.pool.sender("delivery", author=username) as client:
+                    await client.send_message(chat_id=username, text=error_text)
+                print(Fore.RED + f"Сообщение об ошибке отправлено автору {username}" + Style.RESET_ALL)
+                self.routes.remove(username, filename)
+                await self.jobs.settle(username, self.routes.waiting)
+
+            if self.routes.empty:
+                print(Fore.CYAN + "Ожидаю новых файлов от клиента..." + Style.RESET_ALL)
+            return "done"
+
+        self.jobs.handlers = {"relay": relay_to_editor, "deliver": deliver_to_authors}
+        self.jobs.start()
+
+        async def enqueue(kind, state, client, messages, **job):
+            """Обработчики только ставят задачи — сама пересылка идёт в воркерах"""
+            self.pool.talked(self.pool.name_of(client), job.get("author"))
+            try:
+                if await self.jobs.enqueue(kind, state, self.pool.name_of(client), messages, **job):
+                    print(Fore.GREEN + f"Задача поставлена в очередь: {state}, сообщений {len(messages)}"
+                          + Style.RESET_ALL)
+            except Exception as e:
+                print(Fore.RED + f"Ошибка постановки задачи: {e}" + Style.RESET_ALL)
+
+        async def handle_author_album(client, album):
+            check_words = ['.pdf', '.rtf', '.doc', '.docx']
+            print(Fore.CYAN + f"Начата обработка авторской медиагруппы {album[0].media_group_id}" + Style.RESET_ALL)
+
+            media_group = [msg for msg in album
+                           if msg.document and any(ext in msg.document.file_name.lower() for ext in check_words)
+                           and not is_service_file(msg.document.file_name)]
+            if media_group:
+                filenames = [normalize_name(msg.document.file_name.rsplit(".", 1)[0]) for msg in media_group]
+                await enqueue("intake", "relay", client, media_group, author=album[0].from_user.username,
+                              target=editor, filenames=filenames)
+
+        async def handle_editor_album(client2, album):
+            check_words = ['.pdf', '.rtf', '.doc', '.docx', '.txt']
+            print(Fore.CYAN + f"Обработка ответа от редактора {album[0].media_group_id}" + Style.RESET_ALL)
+
+            media_group = [msg for msg in album
+                           if msg.document and any(ext in msg.document.file_name.lower() for ext in check_words)]
+            if media_group:
+                await enqueue("return", "deliver", client2, media_group)
 
+        # Альбомы собираются из входящих обновлений, без get_media_group, отдельно для каждого аккаунта
+        author_albums = {
+            client: AlbumAggregator(lambda album, client=client: handle_author_album(client, album))
+            for client in self.pool.with_role("intake")}
+        editor_albums = {
+            client2: AlbumAggregator(lambda album, client2=client2: handle_editor_album(client2, album))
+            for client2 in self.pool.with_role("editor")}
 
-        @client.on_message(filters.media_group | filters.document)
         async def handle_document(client, message):
-            filenames = []
             if message.text and message.text.lower() == 'stop':
-                processed_media_groups.clear()
+                for albums in author_albums.values():
+                    albums.clear()
                 stop_event.set()
                 return
 
             if message.from_user.username not in authors:
                 return
 
+            check_words = ['.pdf', '.rtf', '.doc', '.docx']
 
-            else:
-                check_words = ['.pdf', '.rtf', '.doc', '.docx']
-
-                # Обработка медиагруппы
-                if message.media_group_id:
-                    if processed_media_groups[message.media_group_id]:
-                        return
-                    processed_media_groups[message.media_group_id] = True
-
-                    print(Fore.CYAN + f"Начата обработка авторской медиагруппы {message.media_group_id}" + Style.RESET_ALL)
-
-                    try:
-                        album = await client.get_media_group(message.chat.id, message.id)
-                        media_group = []
-
-                        for msg in album:
-                            if msg.document and any(ext in msg.document.file_name.lower() for ext in check_words):
-                                if "payment" in msg.document.file_name.lower() or "receipt" in msg.document.file_name.lower() or "document" in msg.document.file_name.lower() and "выполнен" not in msg.document.file_name.lower() or "документ" in msg.document.file_name.lower() or "пэймент" in msg.document.file_name.lower():
-                                    pass
-                                else:
-                                    # Скачиваем файл в оперативную память
-                                    file_data = await msg.download(in_memory=True)
-                                    a = msg.document.file_name.rsplit(".", 1)
-                                    filenames.append(a[0])
-
-                                    # Создаем BytesIO объект из скачанных данных
-                                    file_buffer = BytesIO(
-                                        file_data.getvalue() if hasattr(file_data, 'getvalue') else file_data)
-                                    file_buffer.name = msg.document.file_name
-
-                                    media = InputMediaDocument(
-                                        media=file_buffer
-                                    )
-                                    media_group.append(media)
-
-                        if media_group:
-                            await self.clients['client2'].send_media_group(
-                                chat_id=editor,
-                                media=media_group
-                            )
-                            print(Fore.GREEN + f"Успешно отправлено {len(media_group)} файлов" + Style.RESET_ALL)
-                            dbn = "files.db"
-                            conn = sqlite3.connect(dbn)
-                            cursor = conn.cursor()
-                            for filename in filenames:
-                                cleared = re.sub(r'[^a-zA-Zа-яА-ЯёЁ0-9]', '', filename, flags=re.IGNORECASE)
-                                cursor.execute("""INSERT INTO files (username, filename) 
-                                                                          VALUES (?, ?)""",
-                                               (message.from_user.username, cleared.lower()))
-
-                            conn.commit()
-                            conn.close()
-
-                    except Exception as e:
-                        print(Fore.RED + f"Ошибка обработки медиагруппы: {e}" + Style.RESET_ALL)
-                    finally:
-                        # Закрываем все буферы
-                        for media in media_group:
-                            if hasattr(media.media, 'close'):
-                                media.media.close()
-
-                # Обработка одиночного документа
-                elif message.document and any(ext in message.document.file_name.lower() for ext in check_words):
-                    try:
-                        if "payment" in message.document.file_name.lower() or "receipt" in message.document.file_name.lower() or "document" in message.document.file_name.lower() and "выполнен" not in message.document.file_name.lower() or "документ" in message.document.file_name.lower() or "пэймент" in message.document.file_name.lower():
-                            return
-                        print(Fore.GREEN + f"Начата обработка авторского файла: {message.document.file_name}" + Style.RESET_ALL)
-
-                        # Скачиваем файл в оперативную память
-
-                        file_data = await message.download(in_memory=True)
-
-                        # Создаем BytesIO объект
-                        file_buffer = BytesIO(file_data.getvalue() if hasattr(file_data, 'getvalue') else file_data)
-                        file_buffer.name = message.document.file_name
-
-                        # Отправляем файл редактору
-                        await self.clients['client2'].send_document(
-                            chat_id=editor,
-                            document=file_buffer
-                        )
-                        print(Fore.GREEN + "Файл успешно отправлен редактору" + Style.RESET_ALL)
-                        dbn = "files.db"
-                        conn = sqlite3.connect(dbn)
-                        cursor = conn.cursor()
-                        cleared = re.sub(r'[^a-zA-Zа-яА-ЯёЁ0-9]', '', message.document.file_name.rsplit(".", 1)[0], flags=re.IGNORECASE)
-                        cursor.execute("""INSERT INTO files (username, filename) 
-                                                                    VALUES (?, ?)""",
-                                       (message.from_user.username, cleared.lower()))
-
-                        conn.commit()
-                        conn.close()
+            # Обработка медиагруппы
+            if message.media_group_id:
+                author_albums[client].add(message)
 
-                    except Exception as e:
-                        print(Fore.RED + f"Ошибка обработки файла: {e}" + Style.RESET_ALL)
-                    finally:
-                        if 'file_buffer' in locals():
-                            file_buffer.close()
+            # Обработка одиночного документа
+            elif message.document and any(ext in message.document.file_name.lower() for ext in check_words):
+                if is_service_file(message.document.file_name):
+                    return
+                print(Fore.GREEN + f"Начата обработка авторского файла: {message.document.file_name}" + Style.RESET_ALL)
+                cleared = normalize_name(message.document.file_name.rsplit(".", 1)[0])
+                await enqueue("intake", "relay", client, [message], author=message.from_user.username,
+                              target=editor, filenames=[cleared])
 
-        @client2.on_message(filters.media_group | filters.document)
         async def handle_editor(client2, message):
-            filenames = []
             if message.from_user.username != editor:
                 return
-            if "payment" in message.document.file_name.lower() or "receipt" in message.document.file_name.lower() or "document" in message.document.file_name.lower() and "выполнен" not in message.document.file_name.lower() or "документ" in message.document.file_name.lower() or "пэймент" in message.document.file_name.lower():
-                return
-
-            check_words = ['.pdf', '.rtf', '.doc', '.docx', '.txt']
 
             # Обработка медиагруппы от редактора
             if message.media_group_id:
-                if processed_media_groups.get(message.media_group_id):
-                    return
-
-                processed_media_groups[message.media_group_id] = True
-                print(Fore.CYAN + f"Обработка ответа от редактора {message.media_group_id}" + Style.RESET_ALL)
-
-                try:
-                    await asyncio.sleep(1)  # Даем время на сборку группы
-                    album = await client2.get_media_group(message.chat.id, message.id)
-
-                    # Группируем файлы по авторам
-                    author_files = defaultdict(list)
-
-                    with sqlite3.connect("files.db") as conn:
-                        cursor = conn.cursor()
-
-                        for msg in album:
-                            if msg.document and any(ext in msg.document.file_name.lower() for ext in check_words):
-                                base_name = os.path.splitext(msg.document.file_name)[0]
-                                cleared = re.sub(r'[^a-zA-Zа-яА-ЯёЁ0-9]', '', base_name,
-                                                 flags=re.IGNORECASE)
-
-                                # Получаем автора файла из БД
-                                cursor.execute("SELECT username FROM files WHERE filename = ?", (cleared.lower(),))
-                                result = cursor.fetchone()
-
-                                if result:
-                                    author = result[0]
-                                    file_data = await msg.download(in_memory=True)
-                                    file_buffer = BytesIO(file_data.getvalue())
-                                    file_buffer.name = msg.document.file_name
-
-                                    author_files[author].append((file_buffer, base_name))
-
-                    # Отправляем файлы каждому автору
-                    for author, files in author_files.items():
-                        media_group = [InputMediaDocument(media=fb) for fb, _ in files]
-
-                        try:
-                            await client.send_media_group(
-                                chat_id=author,
-                                media=media_group
-                            )
-                            print(
-                                Fore.GREEN + f"Отправлено {len(media_group)} файлов автору {author}" + Style.RESET_ALL)
-
-                            # Удаляем отправленные файлы из БД
-                            with sqlite3.connect("files.db") as conn:
-                                cursor = conn.cursor()
-                                for _, base_name in files:
-                                    cursor.execute("DELETE FROM files WHERE username = ? AND filename = ?",
-                                                   (author, cleared.lower()))
-                                conn.commit()
-                                cursor.execute("""SELECT COUNT(*) FROM files""")
-                                if cursor.fetchone()[0] == 0:
-                                    print(Fore.CYAN + "Ожидаю новых файлов от клиента..." + Style.RESET_ALL)
-
-                        except Exception as e:
-                            print(Fore.RED + f"Ошибка отправки автору {author}: {e}" + Style.RESET_ALL)
-                        finally:
-                            for fb, _ in files:
-                                fb.close()
+                editor_albums[client2].add(message)
+                return
 
-                except Exception as e:
-                    print(Fore.RED + f"Ошибка обработки медиагруппы: {e}" + Style.RESET_ALL)
+            if is_service_file(message.document.file_name):
+                return
 
-            elif message.document and any(ext in message.document.file_name.lower() for ext in check_words):
-                try:
-                    print(Fore.GREEN + f"Обработка ответа от редактора: {message.document.file_name}" + Style.RESET_ALL)
-                    base_name = os.path.splitext(message.document.file_name)[0]
-                    cleared = re.sub(r'[^a-zA-Zа-яА-ЯёЁ0-9]', '', base_name,
-                                     flags=re.IGNORECASE)
-                    print(cleared.lower())
-
-                    # Используем одно соединение для всех операций с БД
-                    with sqlite3.connect("files.db") as conn:
-                        cursor = conn.cursor()
-
-                        # 1. Находим автора файла
-                        cursor.execute("SELECT username FROM files WHERE filename = ?", (cleared.lower(),))
-                        result = cursor.fetchone()
-
-                        if result:
-                            author = result[0]
-                            file_data = await message.download(in_memory=True)
-                            file_buffer = BytesIO(file_data.getvalue())
-                            file_buffer.name = message.document.file_name
-
-                            # 2. Отправляем файл автору
-                            await client.send_document(
-                                chat_id=author,
-                                document=file_buffer,
-                            )
-                            print(Fore.GREEN + f"Файл отправлен автору {author}" + Style.RESET_ALL)
-
-                            # 3. Удаляем запись из БД
-                            cursor.execute("DELETE FROM files WHERE username = ? AND filename = ?",
-                                           (author, cleared.lower()))
-                            conn.commit()
-
-                            # 4. Проверяем, пуста ли таблица
-                            cursor.execute("SELECT COUNT(*) FROM files")
-                            if cursor.fetchone()[0] == 0:
-                                print(
-                                    Fore.CYAN + "Таблица files пуста. Ожидаю новых файлов от клиента..." + Style.RESET_ALL)
+            check_words = ['.pdf', '.rtf', '.doc', '.docx', '.txt']
 
-                except Exception as e:
-                    print(Fore.RED + f"Ошибка обработки файла: {e}" + Style.RESET_ALL)
-                finally:
-                    if 'file_buffer' in locals():
-                        file_buffer.close()
+            if message.document and any(ext in message.document.file_name.lower() for ext in check_words):
+                print(Fore.GREEN + f"Обработка ответа от редактора: {message.document.file_name}" + Style.RESET_ALL)
+                await enqueue("return", "deliver", client2, [message])
 
-        @client2.on_message(filters.photo | filters.text)
         async def handle_editor_errors(client2, message):
             # Проверяем отправителя
             if message.from_user.username != editor:
@@ -828,61 +2651,29 @@ class App:
             if not error_text or "не проверяется" not in error_text:
                 return
 
-            try:
-                print(Fore.CYAN + "Получено сообщение об ошибке" + Style.RESET_ALL)
-                with sqlite3.connect("files.db") as conn:
-                    cursor = conn.cursor()
-                    # Получаем все записи из БД
-                    cursor.execute("SELECT filename, username FROM files")
-                    records = cursor.fetchall()  # Получаем список кортежей (filename, username)
-                    cleared = re.sub(r'[^a-zA-Zа-яА-ЯёЁ0-9]', '', error_text,
-                                     flags=re.IGNORECASE)
-                    error_text = cleared.lower()
-
-                    # Ищем совпадения в тексте ошибки
-                    for filename, username in records:
-                        if filename in error_text:
-                            try:
-                                # Отправляем сообщение автору
-                                await client.send_message(
-                                    chat_id=username,
-                                    text=message.caption if message.photo else message.text
-                                )
-                                print(Fore.RED +
-                                      f"Сообщение об ошибке отправлено автору {username}" +
-                                      Style.RESET_ALL)
-                                cursor.execute("DELETE FROM files WHERE username = ? AND filename = ?",
-                                               (username, filename))
-                                conn.commit()
-
-                                # Проверяем, пуста ли таблица
-                                cursor.execute("SELECT COUNT(*) FROM files")
-                                if cursor.fetchone()[0] == 0:
-                                    print(
-                                        Fore.CYAN + "Ожидаю новых файлов от клиента..." + Style.RESET_ALL)
-                            except Exception as e:
-                                print(Fore.RED +
-                                      f"Ошибка отправки сообщения {username}: {e}" +
-                                      Style.RESET_ALL)
-
-            except Exception as e:
-                print(Fore.RED + f"Ошибка работы с БД: {e}" + Style.RESET_ALL)
-
-        print(Fore.GREEN + f"Бот запущен как @{(await client.get_me()).username}")
+            print(Fore.CYAN + "Получено сообщение об ошибке" + Style.RESET_ALL)
+            await enqueue("return", "deliver", client2, [message])
+
+        # Авторы пишут на любой приёмный аккаунт, редактор отвечает любому редакторскому
+        for client in self.pool.with_role("intake"):
+            client.add_handler(MessageHandler(handle_document, filters.media_group | filters.document))
+            print(Fore.GREEN + f"Бот запущен как @{client.me.username}")
+        for client2 in self.pool.with_role("editor"):
+            # Отдельные группы: аккаунт может быть одновременно приёмным и редакторским
+            client2.add_handler(MessageHandler(handle_editor, filters.media_group | filters.document), 1)
+            client2.add_handler(MessageHandler(handle_editor_errors, filters.photo | filters.text), 2)
         print(Fore.CYAN + "Ожидаю новых файлов от клиента..." + Style.RESET_ALL)
 
         async def console_input():
             while True:
                 cmd = await asyncio.get_event_loop().run_in_executor(None, input)
                 if cmd.lower() == 'stop':
-                    active = False
-                    conn = sqlite3.connect("files.db")
-                    cursor = conn.cursor()
-                    cursor.execute("DELETE FROM files")
-                    conn.commit()
-                    conn.close()
+                    # Маршруты и задачи остаются в files.db и продолжатся при следующем запуске
                     stop_event.set()
                     break
+                elif cmd.lower() == 'stats':
+                    print(Fore.CYAN + telegram_scheduler.report() + Style.RESET_ALL)
+                    print(Fore.CYAN + await self.jobs.report() + Style.RESET_ALL)
 
         console_task = asyncio.create_task(console_input())
 
@@ -890,145 +2681,278 @@ class App:
             await asyncio.sleep(1)
 
         console_task.cancel()
+        await self.jobs.stop()
         stop_event.clear()
         self.clear_console()
         print(Fore.YELLOW + "Мониторинг остановлен, возвращаемся в меню" + Style.RESET_ALL)
+        print(Fore.CYAN + self.relay.stats.report() + Style.RESET_ALL)
+        print(Fore.CYAN + telegram_scheduler.report() + Style.RESET_ALL)
+        print(Fore.CYAN + await self.jobs.report() + Style.RESET_ALL)
 
-    async def wait_for_editor_response(self, client, editor_username, min_date, timeout=36000):
+    async def wait_for_editor_response(self, client, editor_username, min_date, timeout=36000, after_id=0):
         """
         Ждёт файл от редактора, который был отправлен ПОСЛЕ min_date.
+        Ожидание регистрируется в диспетчере клиента и завершается обработчиком on_message.
         """
         print(Fore.YELLOW + f"Ожидаем новый файл от @{editor_username}..." + Style.RESET_ALL)
 
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            async for message in client.get_chat_history(editor_username, limit=20):  # Проверяем последние 20 сообщений
-                # Пропускаем сообщения, отправленные ДО нашего запроса
-                if message.date <= min_date:
-                    continue
-
-                # Если это документ и он от редактора (не от бота)
-                if message.document and message.from_user.username == editor_username:
-                    file_name = f"{message.document.file_name}"
-                    edited_file_path = await message.download(f"downloads/{file_name}")
-                    print(Fore.BLUE + f"Получен новый файл от редактора: {edited_file_path}" + Style.RESET_ALL)
-                    return edited_file_path
-
-            await asyncio.sleep(5)  # Проверяем каждые 5 секунд
-
-        return None
+        def is_edited_file(message):
+            # Документ от редактора, пришедший после нашего запроса
+            return bool(message.document
+                        and message.from_user
+                        and message.from_user.username == editor_username
+                        and message.date > min_date)
+
+        dispatcher = self.dispatcher_for(client)
+        message = await dispatcher.wait(editor_username, is_edited_file, after_id, timeout)
+        if message is None:
+            return None
+
+        file_name = f"{message.document.file_name}"
+        edited_file_path = await self.download_document(client, message, message.document.file_size,
+                                                        f"downloads/{file_name}", file_name)
+        print(Fore.BLUE + f"Получен новый файл от редактора: {edited_file_path}" + Style.RESET_ALL)
+        return edited_file_path
+
+    def dispatcher_for(self, client):
+        """Диспетчер входящих сообщений для клиента"""
+        for name, dispatcher in self.dispatchers.items():
+            if dispatcher.client is client:
+                return dispatcher
+        raise KeyError("Для клиента не зарегистрирован диспетчер сообщений")
 
     async def notify_error(self, recipient, filename):
         """Уведомление об ошибке"""
-        client = self.clients['client1']
         print(Fore.RED + f"Ошибка при обработке файла: «{filename}»!" + Style.RESET_ALL)
-        await client.send_message(recipient, f"Документ «{filename}» не грузится")
-
-    async def wait_for_bot_response(self, timeout=300):
-        """Ожидание ответа от бота с улучшенной логикой"""
-        client = self.clients['client1']
-        start = datetime.now()
-        last_message_id = 0  # Для отслеживания новых сообщений
+        with self.pool.sender("delivery", author=recipient) as client:
+            await client.send_message(recipient, f"Документ «{filename}» не грузится")
 
+    async def wait_for_bot_response(self, timeout=300, after_id=0):
+        """Ожидание ответа от бота по событию, без опроса истории чата"""
         print(Fore.YELLOW + f"Ожидаем ответа от бота (таймаут {timeout} сек)..." + Style.RESET_ALL)
 
-        while (datetime.now() - start).seconds < timeout:
-            try:
-                # Получаем историю чата
-                async for message in client.get_chat_history(bot_name, limit=10):
-                    # Пропускаем старые сообщения
-                    if message.id <= last_message_id:
-                        continue
-
-                    # Фиксируем ID последнего сообщения
-                    last_message_id = message.id
-
-                    # Проверяем, что сообщение от нужного бота
-                    if not (message.from_user and message.from_user.username == bot_name):
-                        continue
-
-                    # Логируем полученное сообщение (если есть текст)
-                    if hasattr(message, 'text') and message.text:
-                        print(Fore.CYAN + f"Получено сообщение от бота: {message.text}" + Style.RESET_ALL)
-
-                        # Пропускаем сообщение о проверке файла
-                        if "Проверяем файл" in message.text:
-                            continue
+        def is_answer(message):
+            # Проверяем, что сообщение от нужного бота
+            if not (message.from_user and message.from_user.username == bot_name):
+                return False
 
-                        return message
+            # Логируем полученное сообщение (если есть текст)
+            if message.text:
+                print(Fore.CYAN + f"Получено сообщение от бота: {message.text}" + Style.RESET_ALL)
 
-                    # Если есть reply_markup (кнопки), тоже возвращаем сообщение
-                    if hasattr(message, 'reply_markup') and message.reply_markup:
-                        return message
+                # Пропускаем сообщение о проверке файла
+                return "Проверяем файл" not in message.text
 
-                await asyncio.sleep(5)  # Интервал проверки
+            # Если есть reply_markup (кнопки), тоже возвращаем сообщение
+            return bool(message.reply_markup)
 
-            except Exception as e:
-                print(Fore.RED + f"Ошибка при проверке сообщений: {e}" + Style.RESET_ALL)
-                await asyncio.sleep(5)
-
-        print(Fore.RED + "Таймаут ожидания ответа от бота!" + Style.RESET_ALL)
-        return None
-
-    async def get_pdf_report(self, timeout=15):
-        """Получение PDF отчета с улучшенной логикой"""
-        client = self.clients['client1']
-        start = datetime.now()
-        last_message_id = 0
+        message = await self.dispatcher_for(self.pool.first("bot")).wait(bot_name, is_answer, after_id, timeout)
+        if message is None:
+            print(Fore.RED + "Таймаут ожидания ответа от бота!" + Style.RESET_ALL)
+        return message
 
+    async def get_pdf_report(self, timeout=15, after_id=0):
+        """Получение PDF отчета по событию от бота"""
         print(Fore.YELLOW + f"Ожидаем PDF отчет (таймаут {timeout} сек)..." + Style.RESET_ALL)
 
-        while (datetime.now() - start).seconds < timeout:
-            try:
-                async for message in client.get_chat_history(bot_name, limit=10):
-                    if message.id <= last_message_id:
-                        continue
+        def is_report(message):
+            return bool(message.document and message.document.mime_type == "application/pdf")
 
-                    last_message_id = message.id
+        message = await self.dispatcher_for(self.pool.first("bot")).wait(bot_name, is_report, after_id, timeout)
+        if message is None:
+            print(Fore.RED + "Таймаут ожидания PDF отчета!" + Style.RESET_ALL)
+            return None
 
-                    if (message.document and
-                            message.document.mime_type == "application/pdf"):
-                        print(Fore.GREEN + "Найден PDF отчет!" + Style.RESET_ALL)
-                        path = await message.download(
-                            file_name=f"downloads/report_temp_{message.id}.pdf"
-                        )
-                        return path
-
-                await asyncio.sleep(5)
-
-            except Exception as e:
-                print(Fore.RED + f"Ошибка при проверке PDF: {e}" + Style.RESET_ALL)
-                await asyncio.sleep(5)
+        print(Fore.GREEN + "Найден PDF отчет!" + Style.RESET_ALL)
+        try:
+            return await message.download(file_name=f"downloads/report_temp_{message.id}.pdf")
+        except Exception as e:
+            print(Fore.RED + f"Ошибка при скачивании PDF: {e}" + Style.RESET_ALL)
+            return None
+
+_browser = None
+
+
+def browser():
+    """
+    Selenium и webdriver_manager нужны только для выгрузки отчётов,
+    поэтому загружаются при первой выгрузке, а не при старте скрипта
+    """
+    global _browser
+    if _browser is None:
+        from selenium import webdriver
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.chrome.service import Service as ChromeService
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.wait import WebDriverWait
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        _browser = SimpleNamespace(
+            webdriver=webdriver, TimeoutException=TimeoutException, ChromeService=ChromeService,
+            By=By, EC=EC, WebDriverWait=WebDriverWait, ChromeDriverManager=ChromeDriverManager)
+    return _browser
+
+
+class ChromePool:
+    """
+    Пул прогретых headless-браузеров для выгрузки отчётов.
+    Каждая выгрузка идёт в новой вкладке, браузер пересоздаётся после max_jobs задач.
+    """
+
+    # Картинки, шрифты и стили для выгрузки отчёта не нужны
+    BLOCKED_URLS = ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico", "*.webp",
+                    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.css"]
+
+    def __init__(self, size=2, max_jobs=20, download_dir="downloads"):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.download_dir = os.path.abspath(download_dir)
+        self.driver_path = None
+        self.started = False
+        self.idle = queue.Queue()
+        self.jobs = {}  # driver -> число выполненных выгрузок
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Разово находит chromedriver и запускает браузеры пула.
+        Пул считается запущенным, только когда запущены все браузеры:
+        после ошибки следующий вызов дозапускает недостающие.
+        """
+        with self.lock:
+            if self.started:
+                return
+            if self.driver_path is None:
+                self.driver_path = browser().ChromeDriverManager().install()
 
-        print(Fore.RED + "Таймаут ожидания PDF отчета!" + Style.RESET_ALL)
-        return None
+            os.makedirs(self.download_dir, exist_ok=True)
+            while len(self.jobs) < self.size:
+                self.idle.put(self._launch())
+            self.started = True
+        print(Fore.GREEN + f"Запущено браузеров для отчётов: {self.size}" + Style.RESET_ALL)
 
-class web:
-    async def download_raport(self, url, oldname, re, client):
-        chrome_options = webdriver.ChromeOptions()
+    def shutdown(self):
+        """Закрытие всех браузеров пула"""
+        while not self.idle.empty():
+            self._quit(self.idle.get_nowait())
 
-        # Добавляем все необходимые опции
-        download_dir = os.path.abspath("downloads")
+    def _options(self):
+        chrome_options = browser().webdriver.ChromeOptions()
 
-        # Настройки для автоматического скачивания
+        # Настройки для автоматического скачивания и облегчённого профиля
         prefs = {
-            "download.default_directory": download_dir,
+            "download.default_directory": self.download_dir,
             "download.prompt_for_download": False,
             "download.directory_upgrade": True,
             "safebrowsing.enabled": True,
-            "profile.default_content_settings.popups": 0
+            "profile.default_content_settings.popups": 0,
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.stylesheets": 2,
+            "profile.managed_default_content_settings.fonts": 2,
         }
 
         chrome_options.add_experimental_option("prefs", prefs)
         chrome_options.add_argument("--disable-blink-features=AutomationControlled")
         chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         chrome_options.add_experimental_option('useAutomationExtension', False)
-        chrome_options.add_argument('--headless')  # Добавьте для безголового режима
+        chrome_options.add_argument('--headless')
         chrome_options.add_argument('--disable-gpu')
         chrome_options.add_argument('--no-sandbox')
         chrome_options.add_argument('--disable-dev-shm-usage')
+        chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+        chrome_options.add_argument('--disable-extensions')
+        return chrome_options
+
+    def _launch(self):
+        stack = browser()
+        driver = stack.webdriver.Chrome(service=stack.ChromeService(self.driver_path), options=self._options())
+        self.jobs[driver] = 0
+        return driver
+
+    def _quit(self, driver):
+        self.jobs.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _recycle(self, driver):
+        self._quit(driver)
+        return self._launch()
+
+    @staticmethod
+    def _healthy(driver):
+        try:
+            return bool(driver.window_handles)
+        except Exception:
+            return False
 
-        # Инициализация драйвера
+    def _acquire(self, cancelled, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise ReportCancelled()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception(f"Нет свободного браузера для отчёта за {timeout} с")
+            try:
+                return self.idle.get(timeout=min(1, remaining))
+            except queue.Empty:
+                continue
+
+    @contextmanager
+    def tab(self, cancelled=None, timeout=300):
+        """
+        Выдаёт браузер из пула, открыв в нём новую вкладку.
+        Ожидание свободного браузера прерывается отменой выгрузки и ограничено timeout.
+        """
+        driver = self._acquire(cancelled, timeout)
+        try:
+            if not self._healthy(driver):
+                print(Fore.YELLOW + "Браузер не отвечает, перезапускаем" + Style.RESET_ALL)
+                driver = self._recycle(driver)
+
+            base_handle = driver.current_window_handle
+            driver.switch_to.new_window('tab')
+            # Блокировка тяжёлых ресурсов действует на уровне вкладки
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.BLOCKED_URLS})
+
+            try:
+                yield driver
+            finally:
+                driver.close()
+                driver.switch_to.window(base_handle)
+
+            self.jobs[driver] += 1
+            if self.jobs[driver] >= self.max_jobs:
+                driver = self._recycle(driver)
+        except Exception:
+            # Браузер в неизвестном состоянии — заменяем его свежим
+            driver = self._recycle(driver)
+            raise
+        finally:
+            self.idle.put(driver)
+
+
+class ReportCancelled(Exception):
+    """Выгрузка отчёта отменена"""
+
+
+class web:
+    pool = ChromePool(
+        size=config('CHROME_POOL_SIZE', default=2, cast=int),
+        max_jobs=config('CHROME_MAX_JOBS', default=20, cast=int)
+    )
+    # Selenium блокирует поток, поэтому вся работа с браузером идёт в отдельных потоках
+    executor = ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix="report")
+
+    async def download_raport(self, url, oldname, re, client, chat_id):
+        os.makedirs("downloads", exist_ok=True)
+        # У каждой выгрузки своя папка, параллельные задачи не видят чужих файлов
+        job_dir = tempfile.mkdtemp(prefix="report_", dir="downloads")
+        path = None
 
         try:
             print(Fore.CYAN + f"Получена первоначальная ссылка: {url}" + Style.RESET_ALL)
@@ -1038,83 +2962,139 @@ class web:
             d = b[0] + '/apicorp/export' + c[0] + "?short=False&v=1&userId=5&c=0" + e[-1]
             download_url = d
             print(Fore.CYAN + f"Преобразована ссылка для скачивания: {download_url}" + Style.RESET_ALL)
-            driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()),
-                                      options=chrome_options)
+
+            path = await self.fetch_report(download_url, os.path.join(job_dir, oldname))
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(Fore.RED + f"Ошибка при работе с Selenium: {e}" + Style.RESET_ALL)
+
+        if path is None:
+            print(Fore.RED + f"PDF файл не найден в папке {job_dir}!" + Style.RESET_ALL)
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return
+
+        try:
+            if re is None:
+                await client.send_document(
+                    chat_id=chat_id,
+                    document=path,
+                    parse_mode="markdown"
+                )
+            else:
+                await client.send_document(
+                    chat_id=chat_id,
+                    document=path,
+                    caption=re,
+                    parse_mode="markdown"
+                )
+        finally:
+            # После отправки (или её ошибки) папка задачи больше не нужна
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    async def fetch_report(self, download_url, path):
+        """Выгружает отчёт в браузере и кладёт PDF в path"""
+        downloaded = await self.export_report(download_url, os.path.dirname(path))
+        if downloaded is None:
+            return None
+
+        print(Fore.GREEN + f"Найден PDF файл: {os.path.basename(downloaded)}" + Style.RESET_ALL)
+        os.replace(downloaded, path)
+        return path
+
+    async def export_report(self, download_url, job_dir):
+        """
+        Выгрузка отчёта в браузере без блокировки event loop.
+        Возвращает путь к скачанному PDF в job_dir или None.
+        При отмене корутины браузер прекращает ожидания и возвращается в пул.
+        """
+        cancelled = threading.Event()
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, self._export_in_browser, download_url, job_dir, cancelled)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    @staticmethod
+    def _wait(driver, condition, cancelled, timeout=30):
+        """WebDriverWait, который прерывается при отмене выгрузки"""
+        result = browser().WebDriverWait(driver, timeout).until(lambda d: cancelled.is_set() or condition(d))
+        if cancelled.is_set():
+            raise ReportCancelled()
+        return result
+
+    @staticmethod
+    def wait_for_download(job_dir, cancelled, timeout=120, interval=0.1):
+        """
+        Ждёт, пока в папке задачи появится PDF и исчезнет .crdownload.
+        Папка задачи содержит только её файлы, поэтому проверка дешёвая.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with os.scandir(job_dir) as entries:
+                names = [entry.name for entry in entries]
+
+            if not any(name.endswith(".crdownload") for name in names):
+                for name in names:
+                    if name.endswith(".pdf"):
+                        return os.path.join(job_dir, name)
+
+            if cancelled.wait(interval):
+                raise ReportCancelled()
+        return None
+
+    def _export_in_browser(self, download_url, job_dir, cancelled):
+        # Пул запускается при первой выгрузке, дальше браузеры берутся прогретыми
+        self.pool.start()
+        EC, By = browser().EC, browser().By
+        with self.pool.tab(cancelled) as driver:
+            # Файлы этой вкладки скачиваются в папку задачи
+            driver.execute_cdp_cmd("Page.setDownloadBehavior",
+                                   {"behavior": "allow", "downloadPath": os.path.abspath(job_dir)})
             driver.get(download_url)
 
             try:
                 # Универсальное ожидание загрузки страницы
-                WebDriverWait(driver, 30).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "div.export-reports"))
-                )
+                self._wait(driver, EC.presence_of_element_located((By.CSS_SELECTOR, "div.export-reports")),
+                           cancelled)
 
                 # Более надёжный селектор для кнопки создания отчёта
-                make_btn = WebDriverWait(driver, 30).until(
-                    EC.element_to_be_clickable((By.XPATH,
-                                                "//html/body/div[1]/main/div/div[1]/div[1]/div[2]/div[2]/table/tbody/tr/td[3]/div/button"))
-                )
+                make_btn = self._wait(driver, EC.element_to_be_clickable((By.XPATH,
+                                                                          "//html/body/div[1]/main/div/div[1]/div[1]/div[2]/div[2]/table/tbody/tr/td[3]/div/button")),
+                                      cancelled)
                 make_btn.click()
                 print(Fore.GREEN + "Кнопка экспорта успешно нажата" + Style.RESET_ALL)
 
                 # Ожидание появления кнопки скачивания
                 driver.get(download_url)
 
-                WebDriverWait(driver, 30).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "div.export-reports"))
-                )
+                self._wait(driver, EC.presence_of_element_located((By.CSS_SELECTOR, "div.export-reports")),
+                           cancelled)
 
-                make_btn = WebDriverWait(driver, 30).until(
-                    EC.element_to_be_clickable((By.XPATH,
-                                                "//html/body/div[1]/main/div/div[1]/div[1]/div[2]/div[2]/table/tbody/tr/td[3]/div/button"))
-                )
+                make_btn = self._wait(driver, EC.element_to_be_clickable((By.XPATH,
+                                                                          "//html/body/div[1]/main/div/div[1]/div[1]/div[2]/div[2]/table/tbody/tr/td[3]/div/button")),
+                                      cancelled)
                 make_btn.click()
                 print(Fore.GREEN + "Кнопка скачивания успешно нажата" + Style.RESET_ALL)
 
-            except TimeoutException:
+            except browser().TimeoutException:
                 print(Fore.RED + "Таймаут ожидания элемента. Возможные причины:" + Style.RESET_ALL)
                 print("- Изменилась структура страницы")
                 print("- Элемент находится внутри iframe")
                 print("- Требуется прокрутка страницы")
                 # Можно добавить скриншот для диагностики
+                return None
+            except ReportCancelled:
+                raise
             except Exception as e:
                 print(Fore.RED + f"Неожиданная ошибка: {str(e)}" + Style.RESET_ALL)
+                return None
 
-            # Ожидание скачивания файла
-            await asyncio.sleep(10)  # Увеличьте время при медленном интернете
-            print(Fore.CYAN + f"Файл успешно установлен" + Style.RESET_ALL)
-
-        except Exception as e:
-            print(Fore.RED + f"Ошибка при работе с Selenium: {e}" + Style.RESET_ALL)
-        finally:
-            driver.quit()
-
-        download_dir = "downloads"
-        os.makedirs(download_dir, exist_ok=True)
-
-        # Проверяем наличие нового файла
-        for filename in os.listdir(download_dir):
-            print(os.listdir(download_dir))
-            if filename.endswith(".pdf"):
-                print(Fore.GREEN + f"Найден PDF файл: {filename}" + Style.RESET_ALL)
-                os.rename(os.path.join(download_dir, filename), os.path.join(download_dir, oldname))
-                a = App()
-                if re is None:
-                    client.send_document(
-                        chat_id=a.editor,
-                        document=os.path.join(download_dir, oldname),
-                        parse_mode="markdown"
-                    )
-                else:
-                    client.send_document(
-                        chat_id=a.editor,
-                        document=os.path.join(download_dir, oldname),
-                        caption=re,
-                        parse_mode="markdown"
-                    )
-
-
-        print(Fore.RED + "PDF файл не найден в папке downloads!" + Style.RESET_ALL)
-        return None
+            # Ожидание завершения скачивания, прерывается отменой
+            return self.wait_for_download(job_dir, cancelled)
 
 async def main():
     app = App()